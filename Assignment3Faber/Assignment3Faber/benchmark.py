@@ -0,0 +1,247 @@
+"""
+Benchmark of the Microdot request handling path.
+
+Each scenario sends requests to an in-process application through the
+``microdot_test_client`` module, so the results measure request parsing,
+routing, the handler and response writing without any network overhead.
+For every scenario the number of requests per second, the median and 99th
+percentile latencies and the memory allocated per request are reported.
+Allocations are traced with ``tracemalloc`` on CPython, or computed from
+``gc.mem_free()`` deltas with the garbage collector disabled on MicroPython.
+
+Usage::
+
+    python benchmark.py                  # run and compare with the baseline
+    python benchmark.py --save-baseline  # run and store a new baseline
+
+The baseline is stored in ``benchmark_baseline.json``. Results are only
+comparable when they are obtained on the same machine, so the baseline should
+be regenerated before starting work on a different machine.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+from microdot import Microdot, Request, Response, send_file
+from microdot_test_client import TestClient
+from utemplate import Template
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'benchmark_baseline.json')
+
+PAGE_TEMPLATE = '''{% args rows %}
+<!DOCTYPE html>
+<html>
+<head><title>Benchmark</title></head>
+<body>
+<table>
+{% for name, value in rows %}
+<tr><td>{{ name }}</td><td>{{ value }}</td></tr>
+{% endfor %}
+</table>
+</body>
+</html>
+'''
+PAGE_ROWS = [('sensor{}'.format(i), i * 7) for i in range(50)]
+
+
+def create_app():
+    app = Microdot()
+
+    @app.get('/')
+    def index(req):
+        return 'Hello, World!'
+
+    @app.get('/users/<int:id>/<name>')
+    def user(req, id, name):
+        return 'User {} is {}'.format(id, name)
+
+    @app.post('/control')
+    def control(req):
+        return '{red}-{green}-{blue}'.format(**req.form)
+
+    @app.post('/api/config')
+    def config(req):
+        data = req.json
+        data['saved'] = True
+        return data
+
+    @app.get('/style.css')
+    def style(req):
+        return send_file(os.path.join(HERE, 'templates', 'style.css'))
+
+    @app.get('/page')
+    def page(req):
+        return Template('bench.html').generate(PAGE_ROWS), \
+            {'Content-Type': 'text/html'}
+
+    return app
+
+
+SCENARIOS = [
+    ('static', 'GET', '/', None, None),
+    ('parameterized', 'GET', '/users/42/susan', None, None),
+    ('not_found', 'GET', '/missing', None, None),
+    ('form_post', 'POST', '/control',
+     {'Content-Type': 'application/x-www-form-urlencoded'},
+     'red=255&green=128&blue=0'),
+    ('json_post', 'POST', '/api/config', None,
+     {'ssid': 'network', 'password': 'secret', 'api_key': '169MZV28'}),
+    ('send_file', 'GET', '/style.css', None, None),
+    ('template_page', 'GET', '/page', None, None),
+]
+
+
+async def measure_allocations(send, samples):
+    """Return the average number of bytes allocated by a request."""
+    allocated = 0
+    if tracemalloc:
+        tracemalloc.start()
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            await send()
+            allocated += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+    else:  # pragma: no cover
+        for _ in range(samples):
+            gc.collect()
+            gc.disable()
+            free = gc.mem_free()
+            await send()
+            allocated += free - gc.mem_free()
+            gc.enable()
+    return allocated // samples
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[index]
+
+
+async def run_scenario(client, method, path, headers, body, requests):
+    async def send():
+        res = await client.request(method, path, headers=headers, body=body)
+        if res.status_code >= 500:  # pragma: no cover
+            raise RuntimeError('{} {} failed'.format(method, path))
+
+    for _ in range(min(requests // 10, 100)):
+        await send()
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        t = time.perf_counter()
+        await send()
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    return {
+        'requests_per_second': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 4),
+        'alloc_bytes_per_request': await measure_allocations(
+            send, min(requests, 100)),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print('{:<16}{:>12}{:>10}{:>10}{:>12}{:>10}'.format(
+        'scenario', 'req/s', 'p50 ms', 'p99 ms', 'alloc B', 'vs base'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = ''
+        if base:
+            ratio = result['requests_per_second'] / \
+                base['requests_per_second']
+            change = '{:+.1%}'.format(ratio - 1)
+            if ratio < 1 - tolerance:
+                regressions.append('{}: {} req/s, baseline {}'.format(
+                    name, result['requests_per_second'],
+                    base['requests_per_second']))
+            if result['alloc_bytes_per_request'] > \
+                    base['alloc_bytes_per_request'] * (1 + tolerance):
+                regressions.append('{}: {} bytes/request, baseline {}'.format(
+                    name, result['alloc_bytes_per_request'],
+                    base['alloc_bytes_per_request']))
+        print('{:<16}{:>12}{:>10}{:>10}{:>12}{:>10}'.format(
+            name, result['requests_per_second'], result['p50_ms'],
+            result['p99_ms'], result['alloc_bytes_per_request'], change))
+    return regressions
+
+
+async def run(args):
+    app = create_app()
+    client = TestClient(app)
+    results = {}
+    for name, method, path, headers, body in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        results[name] = await run_scenario(client, method, path, headers,
+                                           body, args.requests)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Microdot request handling path.')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='number of timed requests per scenario')
+    parser.add_argument('--scenario', action='append',
+                        help='run only the given scenario (can be repeated)')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='path of the baseline results file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed fractional regression before failing')
+    parser.add_argument('--pool-size', type=int, default=0,
+                        help='number of request and response objects to '
+                        'keep for reuse')
+    args = parser.parse_args()
+    Request.pool_size = Response.pool_size = args.pool_size
+
+    # templates are compiled into an importable directory outside the tree
+    workdir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(workdir, 'templates'))
+    with open(os.path.join(workdir, 'templates', 'bench.html'), 'w') as f:
+        f.write(PAGE_TEMPLATE)
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    Template.initialize(template_dir='templates')
+
+    results = asyncio.run(run(args))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baseline saved to', args.baseline)
+    elif regressions:
+        print('\nRegressions detected:')
+        for regression in regressions:
+            print('  ' + regression)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark of the ``microdot_codecs`` body codecs on sensor payloads.
+
+For each payload the encoded size and the encode and decode times of the
+JSON, CBOR and MessagePack codecs are reported, together with the size
+relative to JSON. The payloads mimic the telemetry of the devices: ADC
+readings of the photoresistor, RGB LED colors and a reading history.
+
+Usage::
+
+    python benchmark_codecs.py
+"""
+import time
+
+from microdot_codecs import JSON, CBOR, MSGPACK
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:  # pragma: no cover
+    def perf_counter():
+        return time.ticks_us() / 1000000
+
+PAYLOADS = [
+    ('adc_reading', {'light': 2731}),
+    ('led_state', {'rgb': [255, 128, 0],
+                   'serial': [[255, 0, 0], [0, 255, 0], [0, 0, 255]],
+                   'buzzer': False}),
+    ('adc_history', {'sensor': 'light',
+                     'interval': 1,
+                     'samples': [(i * 37) % 4096 for i in range(500)]}),
+    ('led_history', [{'t': i, 'rgb': [i % 256, (i * 3) % 256, (i * 7) % 256]}
+                     for i in range(200)]),
+]
+
+
+def measure(f, arg, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        f(arg)
+    return (perf_counter() - start) / repeat * 1000000
+
+
+def main(repeat=200):
+    print('{:<14}{:<9}{:>8}{:>9}{:>12}{:>12}'.format(
+        'payload', 'codec', 'bytes', 'vs json', 'encode us', 'decode us'))
+    for name, payload in PAYLOADS:
+        json_size = len(JSON.dumps(payload))
+        for codec_name, codec in [('json', JSON), ('cbor', CBOR),
+                                  ('msgpack', MSGPACK)]:
+            encoded = codec.dumps(payload)
+            print('{:<14}{:<9}{:>8}{:>9}{:>12.1f}{:>12.1f}'.format(
+                name, codec_name, len(encoded),
+                '{:.0%}'.format(len(encoded) / json_size),
+                measure(codec.dumps, payload, repeat),
+                measure(codec.loads, encoded, repeat)))
+
+
+if __name__ == '__main__':
+    main()
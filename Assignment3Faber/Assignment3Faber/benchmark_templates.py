@@ -0,0 +1,191 @@
+"""
+Benchmark of template loading and rendering with ``utemplate``.
+
+The page used by the ``template_page`` scenario of ``benchmark.py`` is
+rendered in the following ways:
+
+- ``cold``: the compiled template is deleted and a new loader is created
+  before each render, so the template is parsed, compiled, imported and
+  rendered.
+- ``cold_inmemory``: a new ``inmemory.Loader`` is created before each render,
+  so the template is parsed and compiled to a code object in memory.
+- ``cold_bytecode``: as ``cold_inmemory``, but the code object is loaded from
+  the bytecode cache of the loader.
+- ``uncached``: the render function cache is disabled, so the loader is
+  called for each render, and it checks the template files once per scan
+  interval.
+- ``revalidating``: the render function is cached, but it is revalidated by
+  the loader for each render.
+- ``warm``: the render function is cached and never revalidated, as in
+  production mode.
+
+The warm render is then repeated with the code generation options of the
+template compiler, reporting the number of chunks yielded by each render.
+The ``bytes`` mode includes the encoding of the output, which the other modes
+leave to Microdot.
+
+Finally, a page with a two level layout is rendered as a hand written
+template, with nested ``{% include %}`` statements and with ``{% extends %}``
+inheritance.
+
+Usage::
+
+    python benchmark_templates.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+import inmemory
+import source
+from benchmark import PAGE_TEMPLATE, PAGE_ROWS
+from utemplate import Template
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:  # pragma: no cover
+    def perf_counter():
+        return time.ticks_us() / 1000000
+
+TEMPLATE = 'bench.html'
+MODULE = 'templates.bench_html'
+
+
+def cold():
+    Template.initialize(template_dir='templates')
+    sys.modules.pop(MODULE, None)
+    try:
+        os.remove(os.path.join('templates', 'bench_html.py'))
+    except OSError:
+        pass
+    Template(TEMPLATE).render(PAGE_ROWS)
+
+
+def cold_inmemory():
+    Template.initialize(template_dir='templates',
+                        loader_class=inmemory.Loader)
+    render()
+
+
+def cold_bytecode():
+    Template.initialize(template_dir='templates',
+                        loader_class=inmemory.Loader, cache_dir='bytecode')
+    render()
+
+
+def render():
+    Template(TEMPLATE).render(PAGE_ROWS)
+
+
+SCENARIOS = [
+    ('cold', {}, cold),
+    ('cold_inmemory', {}, cold_inmemory),
+    ('cold_bytecode', {}, cold_bytecode),
+    ('uncached', {'cache_size': 0}, render),
+    ('revalidating', {'revalidate': 0}, render),
+    ('warm', {'production': True}, render),
+]
+
+LAYOUTS = {
+    'layout_base.html': (
+        '{% args rows %}\n'
+        '<html><head><title>{% block title %}Bench{% endblock %}</title>'
+        '</head>\n<body>\n{% block body %}{% endblock %}</body></html>\n'),
+    'layout_main.html': (
+        '{% extends "layout_base.html" %}\n'
+        '{% block body %}<main>\n{% block content %}{% endblock %}</main>\n'
+        '{% endblock %}\n'),
+    'layout_extends.html': (
+        '{% args rows %}\n{% extends "layout_main.html" %}\n'
+        '{% block content %}{% for r in rows %}<li>{{r}}</li>{% endfor %}\n'
+        '{% endblock %}\n'),
+    'layout_head.html': (
+        '<html><head><title>Bench</title></head>\n<body>\n'
+        '{% include "layout_open.html" %}'),
+    'layout_open.html': '<main>\n',
+    'layout_close.html': '</main>\n{% include "layout_foot.html" %}',
+    'layout_foot.html': '</body></html>\n',
+    'layout_include.html': (
+        '{% args rows %}\n{% include "layout_head.html" %}\n'
+        '{% for r in rows %}<li>{{r}}</li>{% endfor %}\n'
+        '{% include "layout_close.html" %}\n'),
+    'layout_flat.html': (
+        '{% args rows %}\n<html><head><title>Bench</title></head>\n<body>\n'
+        '<main>\n{% for r in rows %}<li>{{r}}</li>{% endfor %}\n</main>\n'
+        '</body></html>\n'),
+}
+
+COMPILER_MODES = [
+    ('default', {}),
+    ('fstrings', {'USE_FSTRINGS': True}),
+    ('join_loops', {'JOIN_LOOPS': True}),
+    ('both', {'USE_FSTRINGS': True, 'JOIN_LOOPS': True}),
+    ('bytes', {'BYTES': True}),
+]
+
+
+def measure(f, repeat, rounds=5):
+    # the fastest round is reported, as it is the least disturbed by other
+    # processes
+    f()
+    best = None
+    for _ in range(rounds):
+        start = perf_counter()
+        for _ in range(repeat):
+            f()
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / repeat * 1000000
+
+
+def main(repeat=500):
+    workdir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(workdir, 'templates'))
+    with open(os.path.join(workdir, 'templates', TEMPLATE), 'w') as f:
+        f.write(PAGE_TEMPLATE)
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+
+    print('{:<14}{:>12}{:>12}'.format('scenario', 'renders/s', 'us/render'))
+    for name, options, f in SCENARIOS:
+        Template.initialize(template_dir='templates', **options)
+        us = measure(f, repeat // 10 if name.startswith('cold') else repeat)
+        print('{:<14}{:>12.1f}{:>12.1f}'.format(name, 1000000 / us, us))
+
+    print('\n{:<14}{:>12}{:>12}{:>12}'.format('compiler', 'renders/s',
+                                              'us/render', 'chunks'))
+    for name, options in COMPILER_MODES:
+        for option in ['USE_FSTRINGS', 'JOIN_LOOPS', 'BYTES']:
+            setattr(source.Compiler, option, options.get(option, False))
+        Template.initialize(template_dir='templates',
+                            loader_class=inmemory.Loader, production=True)
+        chunks = len(list(Template(TEMPLATE).generate(PAGE_ROWS)))
+        us = measure(render, repeat)
+        print('{:<14}{:>12.1f}{:>12.1f}{:>12}'.format(
+            name, 1000000 / us, us, chunks))
+
+    for option in ['USE_FSTRINGS', 'JOIN_LOOPS', 'BYTES']:
+        setattr(source.Compiler, option, False)
+    for name, text in LAYOUTS.items():
+        with open(os.path.join('templates', name), 'w') as f:
+            f.write(text)
+    Template.initialize(template_dir='templates',
+                        loader_class=inmemory.Loader, production=True)
+    rows = list(range(10))
+    outputs = set()
+    print('\n{:<14}{:>12}{:>12}{:>12}'.format('layout', 'renders/s',
+                                              'us/render', 'chunks'))
+    for name in ['flat', 'include', 'extends']:
+        template = Template('layout_{}.html'.format(name))
+        outputs.add(template.render(rows))
+        chunks = len(list(template.generate(rows)))
+        us = measure(lambda: template.render(rows), repeat)
+        print('{:<14}{:>12.1f}{:>12.1f}{:>12}'.format(
+            name, 1000000 / us, us, chunks))
+    assert len(outputs) == 1, 'the layouts render different pages'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Ahead of time compilation of the ``utemplate`` templates.
+
+Every template in a templates directory is compiled in a pool of worker
+processes, so that the build time scales with the number of cores. Included
+templates are resolved by the compiler and are reported as dependencies of
+the templates that include them. For each template the following files are
+written next to it:
+
+- the compiled render module, ``<name>_<ext>.py``, which is the file that the
+  ``compiled`` and ``recompile`` loaders import.
+- the CPython bytecode of the module, in the ``__pycache__`` directory.
+- with ``--mpy-cross``, the MicroPython bytecode of the module,
+  ``<name>_<ext>.mpy``, to copy to the device instead of the ``.py`` file.
+- with ``--cache-dir``, the code object in the bytecode cache of the
+  ``inmemory`` loader.
+
+With ``--prerender``, the output of the templates that do not depend on their
+arguments is also written to a directory of static assets, optionally with a
+gzip compressed copy, so that these pages can be served as files.
+
+The build stops at the first template that cannot be compiled, and the error
+is reported with a non-zero exit status. With the templates built, the
+application can use the ``compiled.Loader`` class, or ``production=True``, so
+that no template is compiled while a request is handled.
+
+Usage::
+
+    python build_templates.py templates
+    python build_templates.py templates --jobs 4 --mpy-cross mpy-cross
+    python build_templates.py templates --prerender static --gzip
+"""
+import argparse
+import os
+import py_compile
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_EXCEPTION, wait
+
+import inmemory
+from microdot_prerender import gzip_compress
+
+
+def find_templates(template_dir, extensions):
+    """Return the names of the templates in a directory.
+
+    Compiled modules and other files that do not have one of the given
+    extensions are skipped.
+    """
+    return sorted(name for name in os.listdir(template_dir)
+                  if os.path.splitext(name)[1] in extensions and
+                  os.path.isfile(os.path.join(template_dir, name)))
+
+
+def build(template_dir, name, mpy_cross=None, cache_dir=None,
+          prerender_dir=None, gzip=False):
+    """Compile a template and write its render module and bytecode.
+
+    Returns the names of the templates that the module was built from, and
+    whether the output of the template was prerendered. This function runs
+    in the worker processes.
+    """
+    loader = inmemory.Loader(None, template_dir, cache_dir=cache_dir)
+    src, deps = loader.compile_source(name)
+    path = loader.compiled_path(name)
+    # syntax errors in the generated code are reported before the module is
+    # replaced
+    code = compile(src, path, 'exec')
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(src)
+    os.replace(tmp, path)
+    py_compile.compile(path, doraise=True)
+    if mpy_cross:
+        subprocess.run([mpy_cross, '-o', path[:-3] + '.mpy', path],
+                       check=True, capture_output=True)
+    if loader.cache_dir:
+        loader.save_cached(name, code, tuple(deps),
+                           tuple(loader.source_hash(d) for d in deps))
+    prerendered = False
+    if prerender_dir:
+        ns = {}
+        exec(code, ns)
+        # the compiler renders static templates into a "_static" object
+        if '_static' in ns:
+            text = ns['_static'].text
+            if isinstance(text, str):
+                text = text.encode()
+            path = os.path.join(prerender_dir, name)
+            with open(path, 'wb') as f:
+                f.write(text)
+            if gzip:
+                with open(path + '.gz', 'wb') as f:
+                    f.write(gzip_compress(text))
+            prerendered = True
+    return deps, prerendered
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compile the templates in a directory ahead of time.')
+    parser.add_argument('template_dir', nargs='?', default='templates',
+                        help='directory of the templates')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='number of worker processes, the default is '
+                        'the number of cores')
+    parser.add_argument('--ext', action='append',
+                        help='extension of the template files, can be given '
+                        'more than once (default: .html)')
+    parser.add_argument('--mpy-cross', metavar='PATH',
+                        help='mpy-cross executable used to write MicroPython '
+                        'bytecode')
+    parser.add_argument('--cache-dir',
+                        help='bytecode cache directory of the inmemory loader')
+    parser.add_argument('--prerender', metavar='DIR',
+                        help='directory where the output of static templates '
+                        'is written')
+    parser.add_argument('--gzip', action='store_true',
+                        help='also write gzip compressed prerendered pages')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='list the templates and their includes')
+    args = parser.parse_args()
+
+    names = find_templates(args.template_dir, args.ext or ['.html'])
+    if not names:
+        parser.error('no templates found in ' + args.template_dir)
+    if args.cache_dir and not inmemory.marshal:  # pragma: no cover
+        parser.error('--cache-dir requires the marshal module')
+    jobs = max(1, min(args.jobs or 1, len(names)))
+    if args.prerender:
+        os.makedirs(args.prerender, exist_ok=True)
+    options = (args.mpy_cross, args.cache_dir, args.prerender, args.gzip)
+
+    start = time.perf_counter()
+    results = {}
+    failed = None
+    if jobs == 1:
+        for name in names:
+            try:
+                results[name] = build(args.template_dir, name, *options)
+            except Exception as exc:
+                failed = (name, exc)
+                break
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            futures = {executor.submit(build, args.template_dir, name,
+                                       *options): name
+                       for name in names}
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+            for future in done:
+                if future.exception() is not None:
+                    failed = (futures[future], future.exception())
+                    break
+                results[futures[future]] = future.result()
+    elapsed = time.perf_counter() - start
+
+    if failed is not None:
+        name, exc = failed
+        message = str(exc)
+        if isinstance(exc, subprocess.CalledProcessError):
+            message = exc.stderr.decode().strip() or message
+        print('error: {}: {}{}'.format(
+            name, exc.__class__.__name__, ': ' + message if message else ''),
+            file=sys.stderr)
+        sys.exit(1)
+    if args.verbose:
+        for name in names:
+            deps, prerendered = results[name]
+            includes = [d for d in deps if d != name]
+            print('{}{}{}'.format(name, ' <- ' + ', '.join(includes)
+                                  if includes else '',
+                                  ' (prerendered)' if prerendered else ''))
+    print('compiled {} templates in {:.3f} s with {} jobs'.format(
+        len(names), elapsed, jobs))
+    if args.prerender:
+        print('prerendered {} templates into {}'.format(
+            sum(1 for r in results.values() if r[1]), args.prerender))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# Loader that compiles templates in memory, without writing Python modules.
+import io
+import sys
+try:
+    from uos import mkdir
+except:
+    from os import mkdir
+try:
+    from hashlib import sha256
+    from binascii import hexlify
+except ImportError:
+    sha256 = None
+try:
+    import marshal
+except ImportError:
+    marshal = None
+import source
+
+# code objects can only be loaded by the interpreter version that made them
+TAG = getattr(sys.implementation, "cache_tag", None) or sys.version
+
+
+class _Module:
+
+    def __init__(self, render):
+        self.render = render
+
+
+class Loader(source.Loader):
+    """Compile templates to code objects in memory.
+
+    The generated Python source is compiled with ``compile()`` and executed
+    in a private namespace, so nothing is written to the templates directory
+    and no modules are added to ``sys.modules``. Loading a template again
+    reuses the code object if none of its source files changed.
+
+    If ``cache_dir`` is given and the ``marshal`` and ``hashlib`` modules are
+    available, the code objects are also stored in that directory, keyed by
+    the hashes of the template and its includes, so that a new process can
+    load the templates without parsing them or compiling Python code.
+    """
+
+    def __init__(self, pkg, dir, cache_dir=None):
+        super().__init__(pkg, dir)
+        self.cache_dir = cache_dir if marshal and sha256 else None
+        if self.cache_dir:
+            try:
+                mkdir(self.cache_dir)
+            except OSError:
+                pass
+        self.code = {}
+        self.opened = None
+
+    def input_open(self, template):
+        f = super().input_open(template)
+        if self.opened is not None:
+            self.opened.append(template)
+        return f
+
+    def source_hash(self, template):
+        with super().input_open(template) as f:
+            text = f.read()
+        if sha256 is None:
+            return hash(text)
+        return hexlify(sha256(text.encode()).digest()).decode()
+
+    def compile_source(self, name):
+        # returns the Python source and the templates that it was built from
+        self.opened = []
+        try:
+            f_out = io.StringIO()
+            with self.input_open(name) as f_in:
+                source.Compiler(f_in, f_out, loader=self).compile()
+            deps = self.opened
+        finally:
+            self.opened = None
+        return f_out.getvalue(), deps
+
+    def compile_template(self, name):
+        # returns the code object and the templates that it was built from
+        src, deps = self.compile_source(name)
+        return compile(src, self.dir + "/" + name, "exec"), deps
+
+    def cache_path(self, name):
+        return self.cache_dir + "/" + name.replace(".", "_") + ".cache"
+
+    def load_cached(self, name):
+        # returns (code, deps, hashes) from the bytecode cache, or None
+        try:
+            with open(self.cache_path(name), "rb") as f:
+                tag, deps, hashes, code = marshal.load(f)
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+        if tag != TAG:
+            return None
+        return code, deps, hashes
+
+    def save_cached(self, name, code, deps, hashes):
+        with open(self.cache_path(name), "wb") as f:
+            marshal.dump((TAG, deps, hashes, code), f)
+
+    def is_current(self, deps, hashes):
+        try:
+            return [self.source_hash(d) for d in deps] == list(hashes)
+        except OSError:
+            return False
+
+    def load(self, name):
+        entry = self.code.get(name)
+        if entry is None and self.cache_dir:
+            entry = self.load_cached(name)
+        if entry is None or not self.is_current(entry[1], entry[2]):
+            code, deps = self.compile_template(name)
+            entry = (code, tuple(deps),
+                     tuple(self.source_hash(d) for d in deps))
+            if self.cache_dir:
+                self.save_cached(name, *entry)
+        self.code[name] = entry
+        ns = {"__import__": self.import_template}
+        exec(entry[0], ns)
+        return ns["render"]
+
+    def import_template(self, name, *args):
+        # dynamic includes import "<name>_<ext>" modules of compiled templates
+        base, _, ext = name.rpartition("_")
+        return _Module(self.load(base + "." + ext))
@@ -9,6 +9,7 @@ import asyncio
 import io
 import re
 import time
+from random import getrandbits
 
 try:
     import orjson as json
@@ -45,6 +46,12 @@ except ImportError:  # pragma: no cover
             ret = await ret
         return ret
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Lock
+except ImportError:  # pragma: no cover
+    ThreadPoolExecutor = None
+
 try:
     from sys import print_exception
 except ImportError:  # pragma: no cover
@@ -53,6 +60,25 @@ except ImportError:  # pragma: no cover
     def print_exception(exc):
         traceback.print_exc()
 
+try:
+    from time import ticks_ms, ticks_us, ticks_add, ticks_diff
+except ImportError:
+    def ticks_ms():
+        """Return a millisecond counter with an arbitrary reference point."""
+        return int(time.monotonic() * 1000)
+
+    def ticks_us():
+        """Return a microsecond counter with an arbitrary reference point."""
+        return int(time.monotonic() * 1000000)
+
+    def ticks_add(ticks, delta):
+        """Offset a ``ticks_ms`` value by the given number of milliseconds."""
+        return ticks + delta
+
+    def ticks_diff(ticks1, ticks2):
+        """Return the signed difference between two ``ticks_ms`` values."""
+        return ticks1 - ticks2
+
 MUTED_SOCKET_ERRORS = [
     32,  # Broken pipe
     54,  # Connection reset by peer
@@ -106,8 +132,13 @@ class NoCaseDict(dict):
         {}
     """
     def __init__(self, initial_dict=None):
-        super().__init__(initial_dict or {})
-        self.keymap = {k.lower(): k for k in self.keys() if k.lower() != k}
+        if initial_dict:
+            super().__init__(initial_dict)
+            self.keymap = {k.lower(): k for k in self.keys()
+                           if k.lower() != k}
+        else:
+            super().__init__()
+            self.keymap = {}
 
     def __setitem__(self, key, value):
         kl = key.lower()
@@ -285,8 +316,232 @@ class AsyncBytesIO:
         pass
 
 
+class TaskQueue:
+    """A bounded queue of background tasks.
+
+    :param max_size: The maximum number of tasks that can be waiting in the
+                     queue. When the queue is full, adding a task waits until
+                     a task is taken out of it.
+    :param concurrency: The maximum number of tasks that run at the same time.
+
+    Tasks are run by worker coroutines that are started when tasks are added
+    and exit when the queue is empty. Sync functions are invoked in the same
+    way as request handlers. Exceptions raised by tasks are printed and
+    otherwise ignored.
+    """
+    def __init__(self, max_size=16, concurrency=1):
+        self.max_size = max_size
+        self.concurrency = concurrency
+        self.tasks = []
+        self.workers = 0
+        self.not_full = asyncio.Event()
+
+    @property
+    def idle(self):
+        """``True`` if there are no tasks waiting or running."""
+        return not self.tasks and not self.workers
+
+    async def put(self, f, *args, **kwargs):
+        """Add a task to the queue.
+
+        :param f: The function or coroutine function to run.
+        :param args: Positional arguments for the function.
+        :param kwargs: Keyword arguments for the function.
+
+        This method is a coroutine.
+        """
+        while len(self.tasks) >= self.max_size:
+            self.not_full.clear()
+            await self.not_full.wait()
+        self.tasks.append((f, args, kwargs))
+        if self.workers < self.concurrency:
+            self.workers += 1
+            asyncio.create_task(self._worker())
+
+    async def _worker(self):
+        while self.tasks:
+            f, args, kwargs = self.tasks.pop(0)
+            self.not_full.set()
+            try:
+                await invoke_handler(f, *args, **kwargs)
+            except Exception as exc:
+                print_exception(exc)
+        self.workers -= 1
+
+
+class PeriodicTask:
+    """A function that runs periodically in the server's event loop.
+
+    :param interval: The number of seconds between runs.
+    :param f: The function or coroutine function to run.
+    :param jitter: A maximum number of seconds by which each run is randomly
+                   delayed. The random delay does not accumulate, so the
+                   average interval between runs is not affected.
+
+    Runs are scheduled on fixed deadlines, so the time the function takes to
+    run does not make the schedule drift. If a run takes longer than the
+    interval, the deadlines that were missed are skipped and counted as
+    overruns instead of being run back to back.
+    """
+    def __init__(self, interval, f, jitter=0):
+        self.interval = interval
+        self.f = f
+        self.jitter = jitter
+        #: The number of times the function has run.
+        self.runs = 0
+        #: The number of deadlines that were skipped because a previous run
+        #: did not finish in time.
+        self.overruns = 0
+        #: The duration of the last run, in milliseconds.
+        self.last_duration = 0
+        self.task = None
+
+    def start(self):
+        """Start running the function. The first run is immediate."""
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stop running the function."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        # intervals under a millisecond run once per millisecond
+        interval = max(1, int(self.interval * 1000))
+        jitter = int(self.jitter * 1000)
+        deadline = ticks_ms()
+        while True:
+            start = ticks_ms()
+            try:
+                await invoke_handler(self.f)
+            except Exception as exc:
+                print_exception(exc)
+            now = ticks_ms()
+            self.runs += 1
+            self.last_duration = ticks_diff(now, start)
+
+            deadline = ticks_add(deadline, interval)
+            late = ticks_diff(now, deadline)
+            if late > 0:
+                missed = late // interval + 1
+                self.overruns += missed
+                deadline = ticks_add(deadline, missed * interval)
+            delay = ticks_diff(deadline, now)
+            if jitter:
+                delay += (jitter * getrandbits(16)) >> 16
+            await asyncio.sleep(delay / 1000)
+
+
+class RequestScheduler:
+    """A limit on the number of requests that are handled concurrently,
+    with capacity reserved for high priority routes.
+
+    :param max_concurrency: The maximum number of requests that are handled
+                            at the same time.
+    :param reserved: The number of those slots that only high priority
+                     requests can use.
+    :param max_waiting: The maximum number of requests waiting for a slot.
+                        When this number is reached, low priority requests
+                        are shed with a 503 response, starting with the ones
+                        that are waiting. Normal and high priority requests
+                        are never shed.
+
+    Waiting requests are given slots in priority order, and in arrival order
+    within the same priority. The slot of a request is held until its
+    response has been written. Route priorities are assigned with the
+    :meth:`Microdot.priority` decorator.
+
+    Example::
+
+        app.scheduler = RequestScheduler(max_concurrency=3, reserved=1)
+    """
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+    def __init__(self, max_concurrency=4, reserved=1, max_waiting=8):
+        self.max_concurrency = max_concurrency
+        self.reserved = reserved
+        self.max_waiting = max_waiting
+        self.active = {}
+        # waiting requests, as [priority, request, event, admitted] lists
+        # sorted by priority
+        self.waiting = []
+        #: The number of requests that were shed.
+        self.shed = 0
+
+    def _can_run(self, priority):
+        limit = self.max_concurrency
+        if priority < self.HIGH:
+            limit -= self.reserved
+        return len(self.active) < limit
+
+    async def acquire(self, req, priority):
+        """Wait for a slot to handle a request.
+
+        :param req: The request object.
+        :param priority: The priority of the request.
+
+        This method is a coroutine. It returns ``True`` when the request holds
+        a slot, or ``False`` if the request was shed.
+        """
+        if self._can_run(priority):
+            self.active[req] = priority
+            return True
+        if len(self.waiting) >= self.max_waiting:
+            if priority == self.LOW:
+                self.shed += 1
+                return False
+            if self.waiting[-1][0] == self.LOW:
+                # make room by shedding the newest low priority request
+                self.shed += 1
+                self.waiting.pop()[2].set()
+        waiter = [priority, req, asyncio.Event(), False]
+        i = len(self.waiting)
+        while i > 0 and self.waiting[i - 1][0] < priority:
+            i -= 1
+        self.waiting.insert(i, waiter)
+        try:
+            await waiter[2].wait()
+        except asyncio.CancelledError:
+            if waiter[3]:
+                # the slot was given to the request before it was cancelled
+                self.release(req)
+            elif waiter in self.waiting:
+                self.waiting.remove(waiter)
+            raise
+        return waiter[3]
+
+    def release(self, req):
+        """Release the slot held by a request, if any.
+
+        :param req: The request object.
+        """
+        if self.active.pop(req, None) is None:
+            return
+        for i in range(len(self.waiting)):
+            if self._can_run(self.waiting[i][0]):
+                waiter = self.waiting.pop(i)
+                waiter[3] = True
+                # the slot is taken on behalf of the waiter, so that no other
+                # request can take it before the waiter resumes
+                self.active[waiter[1]] = waiter[0]
+                waiter[2].set()
+                break
+
+
 class Request:
     """An HTTP request."""
+    __slots__ = ('app', 'client_addr', 'method', 'url', 'url_prefix',
+                 'subapp', 'path', 'query_string', 'args', 'headers',
+                 'cookies', 'content_length', 'content_type', '_g',
+                 'http_version', '_body', 'body_used', '_stream', 'sock',
+                 '_json', '_form', '_files', 'after_request_handlers',
+                 'deferred', 'url_args', 'route', 'received',
+                 'raw_headers')
+
     #: Specify the maximum payload size that is accepted. Requests with larger
     #: payloads will be rejected with a 413 status code. Applications can
     #: change this maximum as necessary.
@@ -316,9 +571,24 @@ class Request:
     #:    Request.max_readline = 16 * 1024  # 16KB lines allowed
     max_readline = 2 * 1024
 
+    #: Specify how many request objects are kept for reuse after their
+    #: requests are handled, to reduce memory allocations and garbage
+    #: collections. The default of 0 disables the reuse of request objects.
+    #:
+    #: Example::
+    #:
+    #:    Request.pool_size = 2
+    pool_size = 0
+    _pool = []
+
     class G:
         pass
 
+    def __new__(cls, *args, **kwargs):
+        if cls is Request and Request._pool:
+            return Request._pool.pop()
+        return super().__new__(cls)
+
     def __init__(self, app, client_addr, method, url, http_version, headers,
                  body=None, stream=None, sock=None, url_prefix='',
                  subapp=None):
@@ -351,21 +621,20 @@ class Request:
         self.content_length = 0
         #: The parsed ``Content-Type`` header.
         self.content_type = None
-        #: A general purpose container for applications to store data during
-        #: the life of the request.
-        self.g = Request.G()
+        self._g = None
 
         self.http_version = http_version
         if '?' in self.path:
             self.path, self.query_string = self.path.split('?', 1)
             self.args = self._parse_urlencoded(self.query_string)
 
-        if 'Content-Length' in self.headers:
-            self.content_length = int(self.headers['Content-Length'])
-        if 'Content-Type' in self.headers:
-            self.content_type = self.headers['Content-Type']
-        if 'Cookie' in self.headers:
-            for cookie in self.headers['Cookie'].split(';'):
+        content_length = self.headers.get('Content-Length')
+        if content_length:
+            self.content_length = int(content_length)
+        self.content_type = self.headers.get('Content-Type')
+        cookies = self.headers.get('Cookie')
+        if cookies:
+            for cookie in cookies.split(';'):
                 name, value = cookie.strip().split('=', 1)
                 self.cookies[name] = value
 
@@ -377,6 +646,19 @@ class Request:
         self._form = None
         self._files = None
         self.after_request_handlers = []
+        self.deferred = []
+        self.url_args = None
+        #: The URL pattern of the route that handles the request, or ``None``
+        #: if the request did not match a route.
+        self.route = None
+        #: The time at which the request was received, in milliseconds, as
+        #: returned by ``ticks_ms()``.
+        self.received = ticks_ms()
+        #: The header lines of the request as received, as a list of strings,
+        #: if the application has
+        #: :attr:`keep_raw_headers <Microdot.keep_raw_headers>` set, or else
+        #: ``None``. Unlike :attr:`headers`, repeated headers are kept.
+        self.raw_headers = None
 
     @staticmethod
     async def create(app, client_reader, client_writer, client_addr):
@@ -401,20 +683,19 @@ class Request:
 
         # headers
         headers = NoCaseDict()
-        content_length = 0
+        raw_headers = [] if app.keep_raw_headers else None
         while True:
             line = (await Request._safe_readline(
                 client_reader)).strip().decode()
             if line == '':
                 break
+            if raw_headers is not None:
+                raw_headers.append(line)
             header, value = line.split(':', 1)
-            value = value.strip()
-            headers[header] = value
-            if header.lower() == 'content-length':
-                content_length = int(value)
+            headers[header] = value.strip()
 
         # body
-        body = b''
+        content_length = int(headers.get('Content-Length') or 0)
         if content_length and content_length <= Request.max_body_length:
             body = await client_reader.readexactly(content_length)
             stream = None
@@ -422,9 +703,11 @@ class Request:
             body = b''
             stream = client_reader
 
-        return Request(app, client_addr, method, url, http_version, headers,
-                       body=body, stream=stream,
-                       sock=(client_reader, client_writer))
+        req = Request(app, client_addr, method, url, http_version, headers,
+                      body=body, stream=stream,
+                      sock=(client_reader, client_writer))
+        req.raw_headers = raw_headers
+        return req
 
     def _parse_urlencoded(self, urlencoded):
         data = MultiDict()
@@ -441,6 +724,14 @@ class Request:
                         if len(kv) > 1 else b''
         return data
 
+    @property
+    def g(self):
+        """A general purpose container for applications to store data during
+        the life of the request."""
+        if self._g is None:
+            self._g = Request.G()
+        return self._g
+
     @property
     def body(self):
         """The body of the request, as bytes."""
@@ -522,6 +813,36 @@ class Request:
         self.after_request_handlers.append(f)
         return f
 
+    def defer(self, f, *args, **kwargs):
+        """Schedule a function to run in the background once the response has
+        been sent and the connection closed. The function is called with the
+        given arguments and its return value is ignored.
+
+        Example::
+
+            @app.route('/save', methods=['POST'])
+            def save(request):
+                request.defer(write_settings, request.form)
+                return 'Saved!'
+
+        Deferred functions go into the application's
+        :attr:`Microdot.background_tasks` queue, which runs them with its own
+        concurrency limit, so they never delay the sending of responses.
+        """
+        self.deferred.append((f, args, kwargs))
+
+    def recycle(self):
+        """Return this request object to the pool of reusable objects, if
+        the pool is not full. The object must not be used after this method
+        is called. Microdot calls this method for every request it handles,
+        unless the request has deferred functions.
+        """
+        if type(self) is Request and len(Request._pool) < Request.pool_size:
+            self.app = self.headers = self.args = self.cookies = \
+                self._body = self._stream = self.sock = self._g = \
+                self._json = self._form = self._files = None
+            Request._pool.append(self)
+
     @staticmethod
     async def _safe_readline(stream):
         line = (await stream.readline())
@@ -545,6 +866,8 @@ class Response:
                    default is "OK" for responses with a 200 status code and
                    "N/A" for any other status codes.
     """
+    __slots__ = ('status_code', 'headers', 'reason', 'body', 'is_head')
+
     types_map = {
         'css': 'text/css',
         'gif': 'image/gif',
@@ -558,6 +881,25 @@ class Response:
 
     send_file_buffer_size = 1024
 
+    #: Specify how many blocks of ``send_file_buffer_size`` bytes produced by
+    #: a synchronous generator body, such as a rendered template, can be held
+    #: when the generator is iterated in a worker thread. Each chunk is passed
+    #: to the asyncio thread as soon as it is produced, and the chunks that
+    #: accumulate while the client is busy are written together. Worker
+    #: threads are only used on CPython. Set to 0 to iterate the generator in
+    #: the asyncio thread.
+    sync_body_queue_size = 4
+
+    #: When a synchronous generator body is iterated in the asyncio thread,
+    #: control is returned to the event loop after this number of chunks, or
+    #: after ``sync_body_yield_ms`` milliseconds, whichever comes first, so
+    #: that a long render does not block other connections.
+    sync_body_yield_chunks = 32
+
+    #: The maximum time in milliseconds that a synchronous generator body can
+    #: run in the asyncio thread before control is returned to the event loop.
+    sync_body_yield_ms = 10
+
     #: The content type to use for responses that do not explicitly define a
     #: ``Content-Type`` header.
     default_content_type = 'text/plain'
@@ -570,12 +912,23 @@ class Response:
     #: written to the client. Used to exit WebSocket connections cleanly.
     already_handled = None
 
+    #: Specify how many response objects are kept for reuse after they are
+    #: written, to reduce memory allocations and garbage collections. The
+    #: default of 0 disables the reuse of response objects.
+    pool_size = 0
+    _pool = []
+
+    def __new__(cls, *args, **kwargs):
+        if cls is Response and Response._pool:
+            return Response._pool.pop()
+        return super().__new__(cls)
+
     def __init__(self, body='', status_code=200, headers=None, reason=None):
         if body is None and status_code == 200:
             body = ''
             status_code = 204
         self.status_code = status_code
-        self.headers = NoCaseDict(headers or {})
+        self.headers = NoCaseDict(headers)
         self.reason = reason
         if isinstance(body, (dict, list)):
             body = json.dumps(body)
@@ -637,6 +990,16 @@ class Response:
         self.set_cookie(cookie, '', expires='Thu, 01 Jan 1970 00:00:01 GMT',
                         max_age=0, **kwargs)
 
+    def recycle(self):
+        """Return this response object to the pool of reusable objects, if
+        the pool is not full. The object must not be used after this method
+        is called.
+        """
+        if type(self) is Response and self is not Response.already_handled \
+                and len(Response._pool) < Response.pool_size:
+            self.headers = self.body = None
+            Response._pool.append(self)
+
     def complete(self):
         if isinstance(self.body, bytes) and \
                 'Content-Length' not in self.headers:
@@ -648,6 +1011,7 @@ class Response:
 
     async def write(self, stream):
         self.complete()
+        sent = 0
 
         try:
             # status code
@@ -667,19 +1031,17 @@ class Response:
             # body
             if not self.is_head:
                 iter = self.body_iter()
-                async for body in iter:
-                    if isinstance(body, str):  # pragma: no cover
-                        body = body.encode()
-                    try:
+                try:
+                    async for body in iter:
+                        if isinstance(body, str):  # pragma: no cover
+                            body = body.encode()
                         await stream.awrite(body)
-                    except OSError as exc:  # pragma: no cover
-                        if exc.errno in MUTED_SOCKET_ERRORS or \
-                                exc.args[0] == 'Connection lost':
-                            if hasattr(iter, 'aclose'):
-                                await iter.aclose()
-                        raise
-                if hasattr(iter, 'aclose'):  # pragma: no branch
-                    await iter.aclose()
+                        sent += len(body)
+                finally:
+                    # the body is also closed when the write fails or is
+                    # cancelled
+                    if hasattr(iter, 'aclose'):  # pragma: no branch
+                        await iter.aclose()
 
         except OSError as exc:  # pragma: no cover
             if exc.errno in MUTED_SOCKET_ERRORS or \
@@ -687,11 +1049,20 @@ class Response:
                 pass
             else:
                 raise
+        return sent
 
     def body_iter(self):
         if hasattr(self.body, '__anext__'):
-            # response body is an async generator
+            # response body is an async generator, or an iterator that
+            # produces chunks ready to be written, such as the renders of
+            # templates compiled with bytes output
             return self.body
+        if self.sync_body_queue_size and SyncBodyPump.supported and \
+                hasattr(self.body, '__next__') and \
+                not hasattr(self.body, 'read'):
+            # sync generators are iterated in a worker thread
+            return SyncBodyPump(self.body, self.sync_body_queue_size,
+                                self.send_file_buffer_size)
 
         response = self
 
@@ -717,11 +1088,21 @@ class Response:
                         self.i = self.ITER_FILE_OBJ
                     elif hasattr(response.body, '__next__'):
                         self.i = self.ITER_SYNC_GEN
+                        self.chunks = 0
+                        self.start = ticks_ms()
                         return next(response.body)
                     else:
                         self.i = self.ITER_NO_BODY
                         return response.body
                 elif self.i == self.ITER_SYNC_GEN:
+                    self.chunks += 1
+                    if self.chunks >= response.sync_body_yield_chunks or \
+                            ticks_diff(ticks_ms(), self.start) >= \
+                            response.sync_body_yield_ms:
+                        # let other tasks run during long renders
+                        await asyncio.sleep(0)
+                        self.chunks = 0
+                        self.start = ticks_ms()
                     try:
                         return next(response.body)
                     except StopIteration:
@@ -812,8 +1193,265 @@ class Response:
         f = stream or open(filename + file_extension, 'rb')
         return cls(body=f, status_code=status_code, headers=headers)
 
+    @classmethod
+    def stream_json(cls, data, status_code=200, headers=None, ndjson=False,
+                    buffer_size=1024):
+        """Send a JSON response that is serialized incrementally.
+
+        :param data: The data to serialize. Dictionaries, lists, tuples,
+                     generators and async iterables are streamed, at any
+                     nesting level. Other values are serialized with
+                     ``json.dumps()``.
+        :param status_code: The numeric HTTP status code of the response. The
+                            default is 200.
+        :param headers: A dictionary of headers to include in the response.
+        :param ndjson: If ``True``, the items of ``data`` are written as
+                       newline delimited JSON instead of as a JSON array.
+        :param buffer_size: The number of characters that are accumulated
+                            before a chunk is written to the client.
+
+        Only one chunk of the response is held in memory at a time, so this
+        method can be used to return large lists, such as sensor histories,
+        produced by a generator.
+
+        Example::
+
+            @app.route('/history')
+            def history(request):
+                return Response.stream_json(
+                    {'sensor': 'light', 'samples': iter(samples)})
+        """
+        headers = NoCaseDict(headers)
+        if 'Content-Type' not in headers:
+            headers['Content-Type'] = 'application/x-ndjson' if ndjson \
+                else 'application/json; charset=UTF-8'
+        return cls(body=JSONStream(data, ndjson=ndjson,
+                                   buffer_size=buffer_size),
+                   status_code=status_code, headers=headers)
+
+
+class JSONStream:
+    """An asynchronous iterator that serializes data to JSON in chunks.
+
+    :param data: The data to serialize.
+    :param ndjson: If ``True``, the items of ``data`` are serialized as
+                   newline delimited JSON.
+    :param buffer_size: The number of characters in each chunk.
+
+    This class is used by :meth:`Response.stream_json`.
+    """
+    LIST = 0
+    DICT = 1
+    NDJSON = 2
+
+    def __init__(self, data, ndjson=False, buffer_size=1024):
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+        # each stack entry is a [kind, iterator, first_item] list
+        self.stack = []
+        if ndjson:
+            self.stack.append([self.NDJSON, self._iterator(data), True])
+        else:
+            self._value(data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while self.stack and self.size < self.buffer_size:
+            frame = self.stack[-1]
+            try:
+                if hasattr(frame[1], '__anext__'):
+                    item = await frame[1].__anext__()
+                else:
+                    item = next(frame[1])
+            except (StopIteration, StopAsyncIteration):
+                self.stack.pop()
+                self._write(']' if frame[0] == self.LIST else
+                            '}' if frame[0] == self.DICT else
+                            '' if frame[2] else '\n')
+                continue
+            if not frame[2]:
+                self._write('\n' if frame[0] == self.NDJSON else ',')
+            frame[2] = False
+            if frame[0] == self.DICT:
+                self._write(self._dumps(str(item[0])) + ':')
+                item = item[1]
+            self._value(item)
+        if not self.buffer:
+            raise StopAsyncIteration
+        chunk = ''.join(self.buffer).encode()
+        self.buffer = []
+        self.size = 0
+        return chunk
+
+    async def aclose(self):
+        while self.stack:
+            iterator = self.stack.pop()[1]
+            if hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+            elif hasattr(iterator, 'close'):
+                iterator.close()
+
+    def _write(self, s):
+        self.buffer.append(s)
+        self.size += len(s)
+
+    @staticmethod
+    def _dumps(value):
+        s = json.dumps(value)
+        return s.decode() if isinstance(s, bytes) else s
+
+    @staticmethod
+    def _iterator(value):
+        if isinstance(value, dict):
+            return iter(value.items())
+        if hasattr(value, '__anext__') or hasattr(value, '__next__'):
+            return value
+        if hasattr(value, '__aiter__'):
+            return value.__aiter__()
+        return iter(value)
+
+    def _value(self, value):
+        if isinstance(value, dict):
+            self._write('{')
+            self.stack.append([self.DICT, self._iterator(value), True])
+        elif isinstance(value, (list, tuple)) or hasattr(value, '__next__') \
+                or hasattr(value, '__anext__') or \
+                hasattr(value, '__aiter__'):
+            self._write('[')
+            self.stack.append([self.LIST, self._iterator(value), True])
+        else:
+            self._write(self._dumps(value))
+
+
+class SyncBodyPump:
+    """An asynchronous iterator that runs a synchronous generator in a worker
+    thread.
+
+    :param body: The synchronous generator to iterate.
+    :param queue_size: The number of blocks of ``buffer_size`` bytes that are
+                       held while the client is not ready to receive them.
+    :param buffer_size: The size of the blocks counted by ``queue_size``.
+
+    The chunks produced by the generator are passed to the asyncio thread as
+    soon as they are produced, so that slow generators such as large template
+    renders do not block other connections, and streamed responses are not
+    delayed. The chunks that accumulate while the previous ones are written
+    are returned joined. When the held chunks reach the limit, the generator
+    is paused and its thread is released, and it is resumed in a worker
+    thread once the client has received them, so slow clients do not hold
+    threads. This class is used by :meth:`Response.body_iter` when the
+    platform supports threads.
+    """
+    #: ``True`` if the asyncio implementation can exchange data with worker
+    #: threads.
+    supported = ThreadPoolExecutor is not None
+
+    #: The number of worker threads shared by all the pumps. The pumps have
+    #: their own executor, so that they do not take the threads that run the
+    #: sync handlers. Generators that find no free thread start when another
+    #: generator is paused or completes.
+    max_workers = 4
+
+    executor = None
+
+    def __init__(self, body, queue_size=4, buffer_size=1024):
+        self.body = body
+        self.limit = queue_size * buffer_size
+        self.chunks = []
+        self.size = 0
+        # None while the generator runs, then True or the raised exception
+        self.end = None
+        self.lock = Lock()
+        self.ready = asyncio.Event()
+        self.loop = None
+        self.worker = None
+        self.paused = False
+        self.stopped = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.worker is None:
+            self.loop = asyncio.get_running_loop()
+            self._start()
+        while True:
+            with self.lock:
+                if self.chunks:
+                    chunks = self.chunks
+                    self.chunks = []
+                    self.size = 0
+                    resume = self.paused
+                    self.paused = False
+                    break
+                if self.end is not None:
+                    if self.end is True:
+                        raise StopAsyncIteration
+                    raise self.end
+                self.ready.clear()
+            await self.ready.wait()
+        if resume:
+            self._start()
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    async def aclose(self):
+        with self.lock:
+            self.stopped = True
+            paused = self.paused
+        if self.worker is None or paused or self.worker.cancel():
+            # the generator is not running in a worker thread
+            if hasattr(self.body, 'close'):
+                self.body.close()
+
+    def _start(self):
+        if SyncBodyPump.executor is None:
+            SyncBodyPump.executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix='microdot-body')
+        self.worker = SyncBodyPump.executor.submit(self._produce)
+
+    def _put(self, chunk=None, end=None):
+        # Returns False when the generator must be paused
+        with self.lock:
+            if self.stopped or self.loop.is_closed():
+                self.stopped = True
+                return True
+            wake = not self.chunks and self.end is None
+            if end is None:
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+            else:
+                self.end = end
+            if wake:
+                self.loop.call_soon_threadsafe(self.ready.set)
+            if self.size >= self.limit:
+                self.paused = True
+                return False
+            return True
+
+    def _produce(self):
+        try:
+            for chunk in self.body:
+                if self.stopped:
+                    break
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                if not self._put(chunk):
+                    # the thread is released, the generator is resumed when
+                    # the client has received the held chunks
+                    return
+            self._put(end=True)
+        except Exception as exc:
+            self._put(end=exc)
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
 
 class URLPattern():
+    __slots__ = ('url_pattern', 'segments', 'regex')
+
     segment_patterns = {
         'string': '/([^/]+)',
         'int': '/(-?\\d+)',
@@ -825,11 +1463,12 @@ class URLPattern():
 
     def __init__(self, url_pattern):
         self.url_pattern = url_pattern
-        self.segments = []
+        self.segments = ()
         self.regex = None
 
     def compile(self):
         pattern = ''
+        segments = []
         for segment in self.url_pattern.lstrip('/').split('/'):
             if segment and segment[0] == '<':
                 if segment[-1] != '>':
@@ -848,11 +1487,11 @@ class URLPattern():
                         raise ValueError('invalid URL segment type')
                     pattern += self.segment_patterns[type_]
                     parser = self.segment_parsers.get(type_)
-                self.segments.append({'parser': parser, 'name': name,
-                                      'type': type_})
+                # only dynamic segments are stored, as (name, parser) tuples
+                segments.append((name, parser))
             else:
                 pattern += '/' + segment
-                self.segments.append({'parser': None})
+        self.segments = tuple(segments)
         self.regex = re.compile('^' + pattern + '$')
         return self.regex
 
@@ -862,20 +1501,18 @@ class URLPattern():
         cls.segment_parsers[type_name] = parser
 
     def match(self, path):
-        args = {}
         g = (self.regex or self.compile()).match(path)
         if not g:
             return
+        args = {}
         i = 1
-        for segment in self.segments:
-            if 'name' not in segment:
-                continue
+        for name, parser in self.segments:
             arg = g.group(i)
-            if segment['parser']:
-                arg = self.segment_parsers[segment['type']](arg)
+            if parser:
+                arg = parser(arg)
                 if arg is None:
                     return
-            args[segment['name']] = arg
+            args[name] = arg
             i += 1
         return args
 
@@ -916,6 +1553,31 @@ class Microdot:
         self.options_handler = self.default_options_handler
         self.debug = False
         self.server = None
+        #: The queue that runs the functions scheduled with
+        #: :meth:`Request.defer`. Applications can replace it with a
+        #: :class:`TaskQueue` instance with different limits.
+        self.background_tasks = TaskQueue()
+        self.periodic_tasks = []
+        #: The :class:`RequestScheduler` instance that limits the number of
+        #: concurrent requests, or ``None`` to handle all requests as they
+        #: arrive.
+        self.scheduler = None
+        self.route_priorities = {}
+        self.next_priority = None
+        #: An object with a ``log(req, res, sent, duration)`` method that is
+        #: invoked after each response is written, such as
+        #: :class:`AccessLog <microdot_access_log.AccessLog>`, or ``None`` to
+        #: disable access logging.
+        self.access_log = None
+        #: If ``True``, the header lines of each request are also kept as
+        #: received in :attr:`Request.raw_headers`, for example to record the
+        #: traffic of the application.
+        self.keep_raw_headers = False
+        #: The number of seconds that the server waits for in-flight requests
+        #: and background tasks to complete after a shutdown is requested.
+        #: Requests that are still running after this time are cancelled.
+        self.drain_timeout = 10
+        self.connections = {}
 
     def route(self, url_pattern, methods=None):
         """Decorator that is used to register a function as a request handler
@@ -948,9 +1610,15 @@ class Microdot:
                 return 'Hello, world!'
         """
         def decorated(f):
+            # the priority is taken from the priority decorator below this
+            # one, even if other decorators wrapped the function since
+            priority = self.route_priorities.get(f, self.next_priority)
+            if priority is not None:
+                self.route_priorities[f] = priority
+            self.next_priority = None
             self.url_map.append(
                 ([m.upper() for m in (methods or ['GET'])],
-                 URLPattern(url_pattern), f, '', None))
+                 URLPattern(url_pattern), f, '', None, priority))
             return f
         return decorated
 
@@ -1128,10 +1796,11 @@ class Microdot:
                       sub-application. When ``False``, they apply to the entire
                       application. The default is ``False``.
         """
-        for methods, pattern, handler, _prefix, _subapp in subapp.url_map:
+        for methods, pattern, handler, _prefix, _subapp, priority in \
+                subapp.url_map:
             self.url_map.append(
                 (methods, URLPattern(url_prefix + pattern.url_pattern),
-                 handler, url_prefix + _prefix, _subapp or subapp))
+                 handler, url_prefix + _prefix, _subapp or subapp, priority))
         if not local:
             for handler in subapp.before_request_handlers:
                 self.before_request_handlers.append(handler)
@@ -1146,6 +1815,64 @@ class Microdot:
                 self.error_handlers[status_code] = handler
             subapp.error_handlers = {}
 
+    def priority(self, level):
+        """Decorator that assigns a scheduling priority to a route.
+
+        :param level: The priority of the route, which can be
+                      ``RequestScheduler.LOW``, ``RequestScheduler.NORMAL``
+                      (the default for routes without this decorator) or
+                      ``RequestScheduler.HIGH``.
+
+        Priorities are only used when the application has a
+        :attr:`scheduler`. The decorator must be placed below the route
+        decorator, and other decorators can be placed between the two.
+
+        Example::
+
+            @app.post('/control')
+            @app.priority(RequestScheduler.HIGH)
+            def control(request):
+                # ...
+        """
+        def decorated(f):
+            self.route_priorities[f] = level
+            # picked up by the next route decorator, which may receive a
+            # wrapper of this function
+            self.next_priority = level
+            return f
+        return decorated
+
+    def every(self, interval, f, jitter=0):
+        """Register a function to run periodically while the server is
+        running.
+
+        :param interval: The number of seconds between runs, which must be
+                         greater than 0.
+        :param f: The function or coroutine function to run. It is called
+                  without arguments.
+        :param jitter: A maximum number of seconds by which each run is
+                       randomly delayed. The default is 0.
+
+        The function runs in the same event loop as the server, starting when
+        the server starts and stopping when it shuts down. The return value
+        is the :class:`PeriodicTask` instance, which keeps run and overrun
+        counts.
+
+        Example::
+
+            async def sample():
+                history.append(sensor.read())
+
+            app.every(1, sample)
+        """
+        if interval <= 0:
+            raise ValueError('interval must be greater than 0')
+        task = PeriodicTask(interval, f, jitter=jitter)
+        self.periodic_tasks.append(task)
+        if self.server is not None:
+            task.start()
+        return task
+
     @staticmethod
     def abort(status_code, reason=None):
         """Abort the current request and return an error response with the
@@ -1224,7 +1951,15 @@ class Microdot:
                 writer.awrite = MethodType(awrite, writer)
                 writer.aclose = MethodType(aclose, writer)
 
-            await self.handle_request(reader, writer)
+            task = asyncio.current_task()
+            self.connections[task] = writer
+            try:
+                await self.handle_request(reader, writer)
+            except asyncio.CancelledError:
+                # the request did not complete before the drain timeout
+                pass
+            finally:
+                del self.connections[task]
 
         if self.debug:  # pragma: no cover
             print('Starting async server on {host}:{port}...'.format(
@@ -1236,6 +1971,9 @@ class Microdot:
         except TypeError:  # pragma: no cover
             self.server = await asyncio.start_server(serve, host, port)
 
+        for task in self.periodic_tasks:
+            task.start()
+
         while True:
             try:
                 if hasattr(self.server, 'serve_forever'):  # pragma: no cover
@@ -1243,12 +1981,15 @@ class Microdot:
                         await self.server.serve_forever()
                     except asyncio.CancelledError:
                         pass
+                    await self.drain()
                 await self.server.wait_closed()
                 break
             except AttributeError:  # pragma: no cover
                 # the task hasn't been initialized in the server object yet
                 # wait a bit and try again
                 await asyncio.sleep(0.1)
+        if not hasattr(self.server, 'serve_forever'):  # pragma: no cover
+            await self.drain()
 
     def run(self, host='0.0.0.0', port=5000, debug=False, ssl=None):
         """Start the web server. This function does not normally return, as
@@ -1284,11 +2025,17 @@ class Microdot:
         asyncio.run(self.start_server(host=host, port=port, debug=debug,
                                       ssl=ssl))  # pragma: no cover
 
-    def shutdown(self):
-        """Request a server shutdown. The server will then exit its request
-        listening loop and the :func:`run` function will return. This function
-        can be safely called from a route handler, as it only schedules the
-        server to terminate as soon as the request completes.
+    def shutdown(self, drain_timeout=None):
+        """Request a server shutdown. The server stops accepting connections,
+        waits for in-flight requests and background tasks to complete, and
+        then exits its request listening loop, so that the :func:`run`
+        function returns. This function can be safely called from a route
+        handler, as it only schedules the server to terminate as soon as the
+        request completes.
+
+        :param drain_timeout: The number of seconds to wait for in-flight
+                              requests and background tasks. If omitted,
+                              :attr:`drain_timeout` is used.
 
         Example::
 
@@ -1297,33 +2044,70 @@ class Microdot:
                 request.app.shutdown()
                 return 'The server is shutting down...'
         """
+        self.shutdown_requested = True
+        if drain_timeout is not None:
+            self.drain_timeout = drain_timeout
         self.server.close()
 
+    async def drain(self):
+        """Wait for in-flight requests and background tasks to complete.
+
+        Requests that are still running after :attr:`drain_timeout` seconds
+        are cancelled and background tasks that did not start are discarded.
+        The periodic tasks are then stopped and the access log, if any, is
+        flushed and closed. The server calls this method after it stops
+        accepting connections.
+
+        This method is a coroutine.
+        """
+        deadline = ticks_add(ticks_ms(), int(self.drain_timeout * 1000))
+        while (self.connections or not self.background_tasks.idle) and \
+                ticks_diff(deadline, ticks_ms()) > 0:
+            await asyncio.sleep(0.05)
+        if self.debug and (self.connections or
+                           not self.background_tasks.idle):  # pragma: no cover
+            print('Cancelling {} requests and {} background tasks'.format(
+                len(self.connections), len(self.background_tasks.tasks)))
+        for task, writer in list(self.connections.items()):
+            writer.close()
+            task.cancel()
+        self.background_tasks.tasks.clear()
+        for task in self.periodic_tasks:
+            task.stop()
+        if self.access_log is not None and hasattr(self.access_log, 'close'):
+            await self.access_log.close()
+
     def find_route(self, req):
         method = req.method.upper()
         if method == 'OPTIONS' and self.options_handler:
-            return self.options_handler(req), '', None
+            return self.options_handler(req), '', None, \
+                RequestScheduler.NORMAL
         if method == 'HEAD':
             method = 'GET'
         f = 404
         p = ''
         s = None
-        for route_methods, route_pattern, route_handler, url_prefix, subapp \
-                in self.url_map:
+        priority = None
+        for route_methods, route_pattern, route_handler, url_prefix, subapp, \
+                route_priority in self.url_map:
             req.url_args = route_pattern.match(req.path)
             if req.url_args is not None:
                 p = url_prefix
                 s = subapp
                 if method in route_methods:
                     f = route_handler
+                    req.route = route_pattern.url_pattern
+                    priority = route_priority
                     break
                 else:
                     f = 405
-        return f, p, s
+        if priority is None:
+            priority = RequestScheduler.NORMAL
+        return f, p, s, priority
 
     def default_options_handler(self, req):
         allow = []
-        for route_methods, route_pattern, _, _, _ in self.url_map:
+        for route_methods, route_pattern, _, _, _, _ in self.url_map:
             if route_pattern.match(req.path) is not None:
                 allow.extend(route_methods)
         if 'GET' in allow:
@@ -1332,27 +2116,41 @@ class Microdot:
         return {'Allow': ', '.join(allow)}
 
     async def handle_request(self, reader, writer):
+        start = ticks_us()
         req = None
+        sent = 0
         try:
             req = await Request.create(self, reader, writer,
                                        writer.get_extra_info('peername'))
         except Exception as exc:  # pragma: no cover
             print_exception(exc)
 
-        res = await self.dispatch_request(req)
         try:
+            res = await self.dispatch_request(req)
             if res != Response.already_handled:  # pragma: no branch
-                await res.write(writer)
+                sent = await res.write(writer) or 0
             await writer.aclose()
         except OSError as exc:  # pragma: no cover
             if exc.errno in MUTED_SOCKET_ERRORS:
                 pass
             else:
                 raise
+        finally:
+            if self.scheduler is not None and req:
+                self.scheduler.release(req)
         if self.debug and req:  # pragma: no cover
             print('{method} {path} {status_code}'.format(
                 method=req.method, path=req.path,
                 status_code=res.status_code))
+        if self.access_log is not None and req:
+            self.access_log.log(req, res, sent,
+                                ticks_diff(ticks_us(), start))
+        if req:
+            for f, args, kwargs in req.deferred:
+                await self.background_tasks.put(f, *args, **kwargs)
+            if not req.deferred:
+                req.recycle()
+        res.recycle()
 
     def get_request_handlers(self, req, attr, local_first=True):
         handlers = getattr(self, attr + '_handlers')
@@ -1377,11 +2175,16 @@ class Microdot:
                 res = await self.error_response(req, 413, 'Payload too large')
             else:
                 # find the route in the app's URL map
-                f, req.url_prefix, req.subapp = self.find_route(req)
+                f, req.url_prefix, req.subapp, priority = self.find_route(req)
 
                 try:
                     res = None
-                    if callable(f):
+                    if self.scheduler is not None and \
+                            not await self.scheduler.acquire(req, priority):
+                        # the server is busy and the request was shed
+                        res = await self.error_response(
+                            req, 503, 'Service unavailable')
+                    elif callable(f):
                         # invoke the before request handlers
                         for handler in self.get_request_handlers(
                                 req, 'before_request', False):
@@ -1498,4 +2301,5 @@ Response.already_handled = Response()
 abort = Microdot.abort
 redirect = Response.redirect
 send_file = Response.send_file
+stream_json = Response.stream_json
 
@@ -0,0 +1,489 @@
+"""
+microdot_codecs
+---------------
+
+The ``microdot_codecs`` module implements pluggable body codecs for Microdot
+routes, with built-in JSON, CBOR and MessagePack support. The codec used for
+a response is selected from the ``Accept`` header of the request, and the
+codec used to decode a request body from its ``Content-Type`` header.
+"""
+try:
+    import struct
+except ImportError:  # pragma: no cover
+    import ustruct as struct
+
+from microdot import invoke_handler, json
+
+
+class Codec:
+    """A body codec.
+
+    :param content_type: The media type handled by the codec.
+    :param dumps: A function that encodes a Python structure to bytes.
+    :param loads: A function that decodes bytes to a Python structure.
+    :param aliases: Additional media types that are accepted for the codec.
+    """
+    def __init__(self, content_type, dumps, loads, aliases=None):
+        self.content_type = content_type
+        self.dumps = dumps
+        self.loads = loads
+        self.media_types = [content_type] + (aliases or [])
+
+
+def _json_dumps(data):
+    s = json.dumps(data)
+    return s.encode() if isinstance(s, str) else s
+
+
+def _json_loads(data):
+    return json.loads(data.decode() if isinstance(data, bytes) else data)
+
+
+def _cbor_head(out, major, n):
+    if n < 24:
+        out.append(major << 5 | n)
+    elif n < 0x100:
+        out.append(major << 5 | 24)
+        out.append(n)
+    elif n < 0x10000:
+        out.append(major << 5 | 25)
+        out.extend(struct.pack('>H', n))
+    elif n < 0x100000000:
+        out.append(major << 5 | 26)
+        out.extend(struct.pack('>I', n))
+    elif n < 0x10000000000000000:
+        out.append(major << 5 | 27)
+        out.extend(struct.pack('>Q', n))
+    else:
+        raise ValueError('integer too large')
+
+
+def _cbor_encode(out, value):
+    if value is False:
+        out.append(0xf4)
+    elif value is True:
+        out.append(0xf5)
+    elif value is None:
+        out.append(0xf6)
+    elif isinstance(value, int):
+        if value >= 0:
+            _cbor_head(out, 0, value)
+        else:
+            _cbor_head(out, 1, -1 - value)
+    elif isinstance(value, float):
+        out.append(0xfb)
+        out.extend(struct.pack('>d', value))
+    elif isinstance(value, (bytes, bytearray)):
+        _cbor_head(out, 2, len(value))
+        out.extend(value)
+    elif isinstance(value, str):
+        value = value.encode()
+        _cbor_head(out, 3, len(value))
+        out.extend(value)
+    elif isinstance(value, (list, tuple)):
+        _cbor_head(out, 4, len(value))
+        for item in value:
+            _cbor_encode(out, item)
+    elif isinstance(value, dict):
+        _cbor_head(out, 5, len(value))
+        for key, item in value.items():
+            _cbor_encode(out, key)
+            _cbor_encode(out, item)
+    else:
+        raise TypeError('cannot encode {} to CBOR'.format(type(value)))
+
+
+def cbor_dumps(data):
+    """Encode a Python structure to CBOR (RFC 8949).
+
+    Supported types are ``None``, booleans, integers up to 64 bits, floats,
+    bytes, strings, lists, tuples and dictionaries. Floats are encoded in
+    double precision.
+    """
+    out = bytearray()
+    _cbor_encode(out, data)
+    return bytes(out)
+
+
+def _half_to_float(h):
+    exp = (h >> 10) & 0x1f
+    mant = h & 0x3ff
+    if exp == 0:
+        value = mant * 2.0 ** -24
+    elif exp == 0x1f:
+        value = float('nan') if mant else float('inf')
+    else:
+        value = (mant + 1024) * 2.0 ** (exp - 25)
+    return -value if h & 0x8000 else value
+
+
+def _cbor_decode(data, i):
+    initial = data[i]
+    major = initial >> 5
+    info = initial & 0x1f
+    i += 1
+    if major == 7:
+        if info == 20:
+            return False, i
+        elif info == 21:
+            return True, i
+        elif info == 22 or info == 23:
+            return None, i
+        elif info == 25:
+            return _half_to_float(struct.unpack('>H', data[i:i + 2])[0]), \
+                i + 2
+        elif info == 26:
+            return struct.unpack('>f', data[i:i + 4])[0], i + 4
+        elif info == 27:
+            return struct.unpack('>d', data[i:i + 8])[0], i + 8
+        raise ValueError('unsupported CBOR simple value')
+    if info < 24:
+        n = info
+    elif info == 24:
+        n = data[i]
+        i += 1
+    elif info == 25:
+        n = struct.unpack('>H', data[i:i + 2])[0]
+        i += 2
+    elif info == 26:
+        n = struct.unpack('>I', data[i:i + 4])[0]
+        i += 4
+    elif info == 27:
+        n = struct.unpack('>Q', data[i:i + 8])[0]
+        i += 8
+    else:
+        raise ValueError('unsupported CBOR length')
+    if major == 0:
+        return n, i
+    elif major == 1:
+        return -1 - n, i
+    elif major == 2:
+        return bytes(data[i:i + n]), i + n
+    elif major == 3:
+        return bytes(data[i:i + n]).decode(), i + n
+    elif major == 4:
+        value = []
+        for _ in range(n):
+            item, i = _cbor_decode(data, i)
+            value.append(item)
+        return value, i
+    elif major == 5:
+        value = {}
+        for _ in range(n):
+            key, i = _cbor_decode(data, i)
+            value[key], i = _cbor_decode(data, i)
+        return value, i
+    elif major == 6:
+        # tags are ignored and the tagged value is returned
+        return _cbor_decode(data, i)
+
+
+def cbor_loads(data):
+    """Decode CBOR data to a Python structure.
+
+    Indefinite length items are not supported. Tags are ignored.
+    """
+    return _cbor_decode(data, 0)[0]
+
+
+def _msgpack_encode(out, value):
+    if value is None:
+        out.append(0xc0)
+    elif value is False:
+        out.append(0xc2)
+    elif value is True:
+        out.append(0xc3)
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            out.append(value)
+        elif -32 <= value < 0:
+            out.append(value & 0xff)
+        elif value >= 0:
+            if value < 0x100:
+                out.append(0xcc)
+                out.append(value)
+            elif value < 0x10000:
+                out.append(0xcd)
+                out.extend(struct.pack('>H', value))
+            elif value < 0x100000000:
+                out.append(0xce)
+                out.extend(struct.pack('>I', value))
+            else:
+                out.append(0xcf)
+                out.extend(struct.pack('>Q', value))
+        elif value >= -0x80:
+            out.append(0xd0)
+            out.extend(struct.pack('>b', value))
+        elif value >= -0x8000:
+            out.append(0xd1)
+            out.extend(struct.pack('>h', value))
+        elif value >= -0x80000000:
+            out.append(0xd2)
+            out.extend(struct.pack('>i', value))
+        else:
+            out.append(0xd3)
+            out.extend(struct.pack('>q', value))
+    elif isinstance(value, float):
+        out.append(0xcb)
+        out.extend(struct.pack('>d', value))
+    elif isinstance(value, str):
+        value = value.encode()
+        n = len(value)
+        if n < 32:
+            out.append(0xa0 | n)
+        elif n < 0x100:
+            out.append(0xd9)
+            out.append(n)
+        elif n < 0x10000:
+            out.append(0xda)
+            out.extend(struct.pack('>H', n))
+        else:
+            out.append(0xdb)
+            out.extend(struct.pack('>I', n))
+        out.extend(value)
+    elif isinstance(value, (bytes, bytearray)):
+        n = len(value)
+        if n < 0x100:
+            out.append(0xc4)
+            out.append(n)
+        elif n < 0x10000:
+            out.append(0xc5)
+            out.extend(struct.pack('>H', n))
+        else:
+            out.append(0xc6)
+            out.extend(struct.pack('>I', n))
+        out.extend(value)
+    elif isinstance(value, (list, tuple)):
+        n = len(value)
+        if n < 16:
+            out.append(0x90 | n)
+        elif n < 0x10000:
+            out.append(0xdc)
+            out.extend(struct.pack('>H', n))
+        else:
+            out.append(0xdd)
+            out.extend(struct.pack('>I', n))
+        for item in value:
+            _msgpack_encode(out, item)
+    elif isinstance(value, dict):
+        n = len(value)
+        if n < 16:
+            out.append(0x80 | n)
+        elif n < 0x10000:
+            out.append(0xde)
+            out.extend(struct.pack('>H', n))
+        else:
+            out.append(0xdf)
+            out.extend(struct.pack('>I', n))
+        for key, item in value.items():
+            _msgpack_encode(out, key)
+            _msgpack_encode(out, item)
+    else:
+        raise TypeError('cannot encode {} to MessagePack'.format(
+            type(value)))
+
+
+def msgpack_dumps(data):
+    """Encode a Python structure to MessagePack.
+
+    Supported types are ``None``, booleans, integers up to 64 bits, floats,
+    bytes, strings, lists, tuples and dictionaries. Floats are encoded in
+    double precision.
+    """
+    out = bytearray()
+    _msgpack_encode(out, data)
+    return bytes(out)
+
+
+# MessagePack fixed size formats, as (struct format, size)
+_MSGPACK_NUMBERS = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+# MessagePack variable size formats, as (kind, length format, length size)
+_MSGPACK_SIZED = {
+    0xc4: ('bin', '>B', 1), 0xc5: ('bin', '>H', 2), 0xc6: ('bin', '>I', 4),
+    0xd9: ('str', '>B', 1), 0xda: ('str', '>H', 2), 0xdb: ('str', '>I', 4),
+    0xdc: ('array', '>H', 2), 0xdd: ('array', '>I', 4),
+    0xde: ('map', '>H', 2), 0xdf: ('map', '>I', 4),
+}
+
+
+def _msgpack_decode(data, i):
+    b = data[i]
+    i += 1
+    if b < 0x80:
+        return b, i
+    elif b >= 0xe0:
+        return b - 0x100, i
+    elif b == 0xc0:
+        return None, i
+    elif b == 0xc2:
+        return False, i
+    elif b == 0xc3:
+        return True, i
+    elif b in _MSGPACK_NUMBERS:
+        fmt, size = _MSGPACK_NUMBERS[b]
+        return struct.unpack(fmt, data[i:i + size])[0], i + size
+    elif 0xa0 <= b < 0xc0:
+        kind, n = 'str', b & 0x1f
+    elif 0x90 <= b < 0xa0:
+        kind, n = 'array', b & 0x0f
+    elif 0x80 <= b < 0x90:
+        kind, n = 'map', b & 0x0f
+    elif b in _MSGPACK_SIZED:
+        kind, fmt, size = _MSGPACK_SIZED[b]
+        n = struct.unpack(fmt, data[i:i + size])[0]
+        i += size
+    else:
+        raise ValueError('unsupported MessagePack type')
+    if kind == 'bin':
+        return bytes(data[i:i + n]), i + n
+    elif kind == 'str':
+        return bytes(data[i:i + n]).decode(), i + n
+    elif kind == 'array':
+        value = []
+        for _ in range(n):
+            item, i = _msgpack_decode(data, i)
+            value.append(item)
+        return value, i
+    value = {}
+    for _ in range(n):
+        key, i = _msgpack_decode(data, i)
+        value[key], i = _msgpack_decode(data, i)
+    return value, i
+
+
+def msgpack_loads(data):
+    """Decode MessagePack data to a Python structure.
+
+    Extension types are not supported.
+    """
+    return _msgpack_decode(data, 0)[0]
+
+
+JSON = Codec('application/json', _json_dumps, _json_loads)
+CBOR = Codec('application/cbor', cbor_dumps, cbor_loads)
+MSGPACK = Codec('application/msgpack', msgpack_dumps, msgpack_loads,
+                aliases=['application/x-msgpack', 'application/vnd.msgpack'])
+
+
+class BodyCodecs:
+    """A set of body codecs for Microdot routes.
+
+    :param codecs: The list of :class:`Codec` instances to support. The
+                   default is JSON, CBOR and MessagePack.
+    :param default: The codec used when the client does not state a
+                    preference. The default is JSON.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot_codecs import BodyCodecs
+
+        app = Microdot()
+        codecs = BodyCodecs()
+
+        @app.post('/samples')
+        @codecs.negotiate
+        def add_samples(request):
+            samples = codecs.load(request)
+            # ...
+            return {'count': len(samples)}
+    """
+    def __init__(self, codecs=None, default=JSON):
+        self.codecs = codecs or [JSON, CBOR, MSGPACK]
+        self.default = default
+        self.media_types = {}
+        for codec in self.codecs:
+            for media_type in codec.media_types:
+                self.media_types[media_type] = codec
+
+    def select(self, req):
+        """Return the codec that best matches the ``Accept`` header of the
+        request.
+
+        :param req: The request object.
+
+        Ties between media types with the same quality value are resolved in
+        favor of the first codec in the list given to the constructor.
+        """
+        accept = req.headers.get('Accept')
+        if not accept:
+            return self.default
+        best = None
+        best_q = 0
+        for item in accept.split(','):
+            params = item.split(';')
+            codec = self.media_types.get(params[0].strip())
+            if codec is None:
+                if params[0].strip() in ['*/*', 'application/*']:
+                    codec = self.default
+                else:
+                    continue
+            q = 1.0
+            for param in params[1:]:
+                name, _, value = param.strip().partition('=')
+                if name == 'q':
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0
+            if q > best_q or (q == best_q and best is not None and
+                              self.codecs.index(codec) <
+                              self.codecs.index(best)):
+                best = codec
+                best_q = q
+        return best or self.default
+
+    def load(self, req):
+        """Decode the body of a request with the codec that matches its
+        ``Content-Type`` header.
+
+        :param req: The request object.
+
+        Returns ``None`` if the request has no body or its content type is not
+        supported by any of the codecs.
+        """
+        if not req.body or not req.content_type:
+            return None
+        codec = self.media_types.get(req.content_type.split(';')[0].strip())
+        if codec is None:
+            return None
+        return codec.loads(req.body)
+
+    def negotiate(self, f):
+        """Decorator that encodes the dictionaries and lists returned by a
+        route handler with the codec that best matches the request.
+
+        The decorator must be placed below the route decorator. Responses of
+        other types are returned unchanged.
+        """
+        async def negotiated_handler(req, *args, **kwargs):
+            res = await invoke_handler(f, req, *args, **kwargs)
+            if isinstance(res, tuple):
+                body = res[0]
+            else:
+                body = res
+            if not isinstance(body, (dict, list)):
+                return res
+            codec = self.select(req)
+            body = codec.dumps(body)
+            if isinstance(res, tuple):
+                status_code = 200
+                headers = {}
+                if len(res) > 1:
+                    if isinstance(res[1], int):
+                        status_code = res[1]
+                        headers = res[2] if len(res) > 2 else {}
+                    else:
+                        headers = res[1]
+            else:
+                status_code = 200
+                headers = {}
+            headers = dict(headers)
+            headers['Content-Type'] = codec.content_type
+            headers['Vary'] = 'Accept'
+            return body, status_code, headers
+        return negotiated_handler
@@ -0,0 +1,164 @@
+"""
+microdot_recorder
+-----------------
+
+The ``microdot_recorder`` module implements a middleware that records the
+requests received by a Microdot application into a capture file, so that the
+traffic can be replayed later for performance testing.
+"""
+try:
+    import struct
+except ImportError:  # pragma: no cover
+    import ustruct as struct
+
+from microdot import invoke_handler, ticks_ms, ticks_diff
+
+#: The first bytes of a capture file.
+MAGIC = b'MDCAP1\n'
+
+# each record is the offset in milliseconds from the start of the capture and
+# the length of the request, followed by the request bytes
+RECORD_HEADER = '<II'
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+
+
+def read_capture(path):
+    """Read the requests stored in a capture file.
+
+    :param path: The path of the capture file.
+
+    This function is a generator that yields a tuple with the offset in
+    milliseconds from the start of the capture and the raw bytes of each
+    request.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('not a capture file')
+        while True:
+            header = f.read(RECORD_HEADER_SIZE)
+            if len(header) < RECORD_HEADER_SIZE:
+                break
+            offset, length = struct.unpack(RECORD_HEADER, header)
+            yield offset, f.read(length)
+
+
+class TrafficRecorder:
+    """Record the requests received by an application.
+
+    :param app: The application instance. If omitted, :meth:`initialize` must
+                be called later.
+    :param path: The path of the capture file. An existing file is replaced.
+    :param buffer_size: The number of bytes that are buffered in memory before
+                        they are written to the capture file.
+
+    Each request is stored with its request line, headers and body as they
+    were received, and with the time at which it was received relative to the
+    start of the capture.
+    Requests with bodies that are only available as a stream are not stored,
+    and are counted in :attr:`skipped`. Call :meth:`close` to write the
+    buffered requests before the application exits.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot_recorder import TrafficRecorder
+
+        app = Microdot()
+        recorder = TrafficRecorder(app, 'session.cap')
+
+    The capture can then be replayed with the ``replay.py`` tool.
+    """
+    def __init__(self, app=None, path='capture.cap', buffer_size=4096):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+        self.start = ticks_ms()
+        #: The number of requests that were recorded.
+        self.recorded = 0
+        #: The number of requests that could not be recorded.
+        self.skipped = 0
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+        if app is not None:
+            self.initialize(app)
+
+    def initialize(self, app):
+        """Install the recorder in an application.
+
+        :param app: The application instance.
+        """
+        app.keep_raw_headers = True
+        app.after_request(self.record)
+        app.after_error_request(self.record)
+
+    async def record(self, req, res):
+        """Store a request in the capture.
+
+        :param req: The request object.
+        :param res: The response object.
+
+        This method is a coroutine. It is installed as an after request
+        handler, so that requests that end in an error are also recorded. The
+        requests are stored in the order in which they complete, each with the
+        time at which it was received.
+        """
+        if req is None:
+            return res
+        data = self.serialize(req)
+        if data is None:
+            self.skipped += 1
+            return res
+        self.buffer.append(struct.pack(
+            RECORD_HEADER, ticks_diff(req.received, self.start), len(data)))
+        self.buffer.append(data)
+        self.size += RECORD_HEADER_SIZE + len(data)
+        self.recorded += 1
+        if self.size >= self.buffer_size:
+            await self.flush()
+        return res
+
+    async def flush(self):
+        """Write the buffered requests to the capture file.
+
+        This method is a coroutine.
+        """
+        if self.buffer:
+            data = b''.join(self.buffer)
+            self.buffer = []
+            self.size = 0
+            await invoke_handler(self._write, data)
+
+    async def close(self):
+        """Write the buffered requests and stop recording.
+
+        This method is a coroutine.
+        """
+        await self.flush()
+
+    @staticmethod
+    def serialize(req):
+        """Return the raw bytes of a request.
+
+        :param req: The request object.
+
+        ``None`` is returned if the body of the request is not available. The
+        headers are written as received when the application keeps them, or
+        else rebuilt from :attr:`Request.headers <microdot.Request.headers>`.
+        """
+        body = req.body or b''
+        if len(body) != req.content_length:
+            return None
+        lines = ['{} {} HTTP/{}'.format(req.method, req.url,
+                                        req.http_version)]
+        if req.raw_headers is not None:
+            lines += req.raw_headers
+        else:
+            for name, value in req.headers.items():
+                lines.append('{}: {}'.format(name, value))
+        lines.append('\r\n')
+        return '\r\n'.join(lines).encode() + body
+
+    def _write(self, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
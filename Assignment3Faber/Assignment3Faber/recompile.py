@@ -3,21 +3,95 @@ try:
     from uos import stat, remove
 except:
     from os import stat, remove
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+import sys
 import source
 
 
 
 class Loader(source.Loader):
 
-    def load(self, name):
-        o_path = self.pkg_path + self.compiled_path(name)
-        i_path = self.pkg_path + self.dir + "/" + name
+    # Templates are recompiled when the template or one of its includes
+    # changes. The files are checked in one scan every scan_interval seconds.
+    def __init__(self, pkg, dir, scan_interval=1):
+        super().__init__(pkg, dir)
+        self.scan_interval = int(scan_interval * 1000)
+        self.scanned = None
+        # render functions of the templates loaded by this loader
+        self.renders = {}
+        # templates that each loaded template was built from
+        self.deps = {}
+        # mtimes of those templates at the last scan
+        self.mtimes = {}
+
+    def mtime(self, path):
         try:
-            o_stat = stat(o_path)
-            i_stat = stat(i_path)
-            if i_stat[8] > o_stat[8]:
-                # input file is newer, remove output to force recompile
-                remove(o_path)
-        finally:
-            return super().load(name)
+            return stat(self.pkg_path + path)[8]
+        except OSError:
+            return None
+
+    def scan(self):
+        changed = []
+        for name, mtime in self.mtimes.items():
+            m = self.mtime(self.dir + "/" + name)
+            if m != mtime:
+                changed.append(name)
+                self.mtimes[name] = m
+        if changed:
+            for name, deps in list(self.deps.items()):
+                for dep in deps:
+                    if dep in changed:
+                        self.invalidate(name)
+                        break
+
+    def invalidate(self, name):
+        # remove output to force recompile
+        try:
+            remove(self.pkg_path + self.compiled_path(name))
+        except OSError:
+            pass
+        # and forget the old module, so that it is imported again
+        sys.modules.pop(self.p + name.replace(".", "_"), None)
+        self.renders.pop(name, None)
+        self.deps.pop(name, None)
+
+    def load(self, name):
+        now = ticks_ms()
+        if self.scanned is None or ticks_diff(now, self.scanned) >= self.scan_interval:
+            self.scanned = now
+            self.scan()
+        render = self.renders.get(name)
+        if render is None:
+            render = self.load_checked(name)
+            self.renders[name] = render
+        return render
 
+    def load_checked(self, name):
+        for i in range(2):
+            render = super().load(name)
+            module = sys.modules.get(self.p + name.replace(".", "_"))
+            deps = (name,) + getattr(module, "INCLUDES", ())
+            o_mtime = self.mtime(self.compiled_path(name))
+            mtimes = [self.mtime(self.dir + "/" + d) for d in deps]
+            if i or o_mtime is None or not [m for m in mtimes if m is None or m > o_mtime]:
+                break
+            # an input file is newer than the compiled module
+            self.invalidate(name)
+        self.deps[name] = deps
+        for d, m in zip(deps, mtimes):
+            if d in self.mtimes and self.mtimes[d] != m:
+                # the templates loaded before were built from the old version
+                for other, other_deps in list(self.deps.items()):
+                    if other != name and d in other_deps:
+                        self.invalidate(other)
+            self.mtimes[d] = m
+        return render
@@ -0,0 +1,165 @@
+"""
+Replay of the requests stored in a capture file.
+
+Captures are recorded with the ``microdot_recorder`` module. The requests are
+sent either to a Microdot application in the same process, through the
+``microdot_test_client`` module, or to an HTTP server through a socket. The
+socket mode also works with servers that are not built with Microdot, such as
+the one in ``assignment3.py``.
+
+The requests are sent at the pace at which they were recorded, at a multiple
+of that pace, or as fast as possible. The throughput, the latency percentiles
+and the number of responses for each status code are reported.
+
+Usage::
+
+    python replay.py session.cap --app benchmark:create_app     # 1x, in memory
+    python replay.py session.cap --app main:app --speed 10      # 10x
+    python replay.py session.cap --host 192.168.4.1 --speed 0   # max speed
+"""
+import argparse
+import asyncio
+import importlib
+import time
+
+from benchmark import percentile
+from microdot import Microdot
+from microdot_recorder import read_capture
+from microdot_test_client import TestClient
+
+
+def load_app(spec):
+    """Return the application given as ``module:name``.
+
+    If the name refers to a function instead of an application, the function
+    is called to create the application.
+    """
+    module_name, _, name = spec.partition(':')
+    app = getattr(importlib.import_module(module_name), name or 'app')
+    if not isinstance(app, Microdot):
+        app = app()
+    return app
+
+
+def memory_sender(app):
+    client = TestClient(app)
+
+    async def send(data):
+        return (await client.send(data)).status_code
+
+    return send
+
+
+def socket_sender(host, port):
+    async def send(data):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(data)
+            await writer.drain()
+            status = await reader.readline()
+            length = None
+            while True:
+                line = await reader.readline()
+                if line.strip() == b'':
+                    break
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'content-length':
+                    length = int(value)
+            if not data.startswith(b'HEAD '):
+                if length is None:
+                    await reader.read()
+                else:
+                    await reader.readexactly(length)
+        finally:
+            writer.close()
+        return int(status.split()[1])
+
+    return send
+
+
+async def replay(requests, send, speed, concurrency):
+    latencies = []
+    statuses = {}
+
+    async def run(data):
+        t = time.perf_counter()
+        try:
+            status = await send(data)
+        except Exception as exc:
+            status = exc.__class__.__name__
+        latencies.append(time.perf_counter() - t)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    if speed > 0:
+        # each request is sent at its recorded offset, scaled by the speed
+        tasks = []
+        for offset, data in requests:
+            delay = offset / 1000 / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(run(data)))
+        await asyncio.gather(*tasks)
+    else:
+        pending = iter(requests)
+
+        async def worker():
+            for _, data in pending:
+                await run(data)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - start, sorted(latencies), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay a capture file against a Microdot application or '
+        'an HTTP server.')
+    parser.add_argument('capture', help='path of the capture file')
+    parser.add_argument('--app',
+                        help='application to send the requests to in memory, '
+                        'given as module:name')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='host of the server, when --app is not given')
+    parser.add_argument('--port', type=int, default=80,
+                        help='port of the server, when --app is not given')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='multiple of the recorded pace, or 0 to send '
+                        'the requests as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='number of concurrent requests with --speed 0')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of times the capture is replayed')
+    args = parser.parse_args()
+
+    # the requests are recorded when they complete, so they are sorted by
+    # the time at which they were received, and the replay starts with the
+    # first request
+    requests = sorted(read_capture(args.capture), key=lambda r: r[0])
+    if not requests:
+        parser.error('the capture file has no requests')
+    requests = [(offset - requests[0][0], data) for offset, data in requests]
+    if args.repeat > 1:
+        # repetitions follow each other at the recorded pace
+        duration = requests[-1][0] + 1
+        requests = [(offset + i * duration, data)
+                    for i in range(args.repeat) for offset, data in requests]
+    send = memory_sender(load_app(args.app)) if args.app \
+        else socket_sender(args.host, args.port)
+
+    elapsed, latencies, statuses = asyncio.run(
+        replay(requests, send, args.speed, args.concurrency))
+
+    print('requests     {}'.format(len(latencies)))
+    print('elapsed      {:.3f} s'.format(elapsed))
+    print('throughput   {:.1f} req/s'.format(len(latencies) / elapsed))
+    for p in [50, 90, 99]:
+        print('p{:<11}{:.3f} ms'.format(
+            p, percentile(latencies, p) * 1000))
+    print('max          {:.3f} ms'.format(latencies[-1] * 1000))
+    for status, count in sorted(statuses.items(), key=lambda s: str(s[0])):
+        print('status {:<6}{}'.format(status, count))
+
+
+if __name__ == '__main__':
+    main()
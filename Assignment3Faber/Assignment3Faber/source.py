@@ -1,4 +1,5 @@
 # (c) 2014-2019 Paul Sokolovsky. MIT license.
+import io
 import compiled
 
 
@@ -10,15 +11,36 @@ class Compiler:
     STMNT_END = "%}"
     EXPR = "{"
     EXPR_END = "}}"
+    # Render each chunk with an f-string instead of a format string
+    USE_FSTRINGS = False
+    # Render "for" loops that only output text with a single join. The join
+    # runs a list comprehension, whose variables do not exist after the loop,
+    # so loops with variables that are used after them are not joined
+    JOIN_LOOPS = False
+    # Render bytes instead of strings, with the literals encoded in advance
+    BYTES = False
 
-    def __init__(self, file_in, file_out, indent=0, seq=0, loader=None):
+    def __init__(self, file_in, file_out, indent=0, seq=0, loader=None, is_async=None):
         self.file_in = file_in
         self.file_out = file_out
         self.loader = loader
+        # None means that the mode is detected from the template source
+        self.is_async = is_async
+        # Templates included statically, directly or through other includes
+        self.includes = []
+        # TTLs of the enclosing "cache" blocks, which collect their output
+        self.caches = []
+        # Whether the output does not depend on the arguments, and the
+        # literal text that makes it up
+        self.static = True
+        self.text = []
         self.seq = seq
         self._indent = indent
         self.stack = []
-        self.in_literal = False
+        # Output that is not written yet, as (is_expr, text) tuples
+        self.parts = []
+        # Header of a "for" loop that may be rendered with a join
+        self.loop = None
         self.flushed_header = False
         self.args = "*a, **d"
 
@@ -26,31 +48,139 @@ class Compiler:
         if not self.flushed_header:
             self.flushed_header = True
             self.indent()
-            self.file_out.write("def render%s(%s):\n" % (str(self.seq) if self.seq else "", self.args))
+            if self.is_async:
+                # chunks are passed to an "_emit" coroutine, as async
+                # generators are not available in MicroPython
+                args = "_emit, " + self.args if self.args else "_emit"
+                self.file_out.write("async def render%s(%s):\n" % (str(self.seq) if self.seq else "_async", args))
+            else:
+                self.file_out.write("def render%s(%s):\n" % (str(self.seq) if self.seq else "_bytes" if self.BYTES else "", self.args))
             self.stack.append("def")
         self.file_out.write("    " * (len(self.stack) + self._indent + adjust))
 
     def literal(self, s):
         if not s:
             return
-        if not self.in_literal:
-            self.indent()
-            self.file_out.write('yield """')
-            self.in_literal = True
-        self.file_out.write(s.replace('"', '\\"'))
-
-    def close_literal(self):
-        if self.in_literal:
-            self.file_out.write('"""\n')
-        self.in_literal = False
+        if self.parts and not self.parts[-1][0]:
+            # merge with the previous literal
+            self.parts[-1] = (False, self.parts[-1][1] + s)
+        else:
+            self.parts.append((False, s))
 
     def render_expr(self, e):
+        c = self.constant(e)
+        if c is not None:
+            self.literal(c)
+        else:
+            self.parts.append((True, e))
+            self.static = False
+
+    @staticmethod
+    def constant(e):
+        # Returns the text of an expression that is a string or integer
+        # constant, or None
+        if len(e) > 1 and e[0] in "\"'" and e[-1] == e[0] and \
+                e[0] not in e[1:-1] and "\\" not in e:
+            return e[1:-1]
+        if e.isdigit():
+            return e
+        return None
+
+    @staticmethod
+    def quote(s):
+        return '"""' + s.replace("\\", "\\\\").replace('"', '\\"') + '"""'
+
+    def chunk(self):
+        # Returns an expression that renders the parts as a single chunk
+        if not self.BYTES:
+            return self.text_chunk()
+        if len(self.parts) == 1 and not self.parts[0][0]:
+            return repr(self.parts[0][1].encode())
+        # Encoding the literals of the chunk with the expressions is faster
+        # than joining them with separately encoded expressions
+        return "(%s).encode()" % self.text_chunk()
+
+    def joiner(self):
+        return 'b"".join' if self.BYTES else '"".join'
+
+    def text_chunk(self):
+        # Returns an expression that renders the parts as a single string
+        if self.USE_FSTRINGS and len(self.parts) > 1:
+            f = []
+            for is_expr, text in self.parts:
+                if not is_expr:
+                    f.append(self.quote(text)[3:-3].replace("{", "{{").replace("}", "}}"))
+                elif any(c in text for c in "\\\"'#{}:!\n"):
+                    break
+                else:
+                    f.append("{" + text + "}")
+            else:
+                return 'f"""' + "".join(f) + '"""'
+        if len(self.parts) == 1:
+            is_expr, text = self.parts[0]
+            return "str(%s)" % text if is_expr else self.quote(text)
+        # Literals are merged into a format string for the expressions
+        fmt = []
+        args = []
+        for is_expr, text in self.parts:
+            if is_expr:
+                fmt.append("%s")
+                args.append("(%s), " % text)
+            else:
+                fmt.append(text.replace("%", "%%"))
+        return "%s %% (%s)" % (self.quote("".join(fmt)), "".join(args))
+
+    def emitter(self):
+        # Returns the coroutine that receives the chunks in async mode
+        if self.caches:
+            return "AsyncRender.collector(_b%d)" % len(self.caches)
+        return "_emit"
+
+    def emit(self, expr):
+        self.indent()
+        if self.caches:
+            self.file_out.write("_b%d.append(%s)\n" % (len(self.caches), expr))
+        elif self.is_async:
+            self.file_out.write("await _emit(%s)\n" % expr)
+        else:
+            self.file_out.write("yield %s\n" % expr)
+
+    def flush(self):
+        if self.parts:
+            if self.static:
+                self.text.append(self.parts[0][1])
+            self.emit(self.chunk())
+            self.parts = []
+
+    def open_loop(self):
+        # The loop body has statements, so the loop is rendered normally
+        stmt = self.loop
+        parts = self.parts
+        self.loop = None
+        self.parts = []
         self.indent()
-        self.file_out.write('yield str(' + e + ')\n')
+        self.file_out.write(stmt + ":\n")
+        self.stack.append("for")
+        self.parts = parts
+        self.flush()
 
     def parse_statement(self, stmt):
         tokens = stmt.split(None, 1)
-        if tokens[0] == "args":
+        if self.loop is not None:
+            if tokens[0] == "endfor":
+                self.emit("%s([%s %s])" % (
+                    self.joiner(), self.chunk() if self.parts else 'b""' if self.BYTES else '""', self.loop))
+                self.parts = []
+                self.loop = None
+                return
+            self.open_loop()
+        if tokens[0] != "args":
+            self.flush()
+            if tokens[0] != "include" or tokens[1][0] == "{":
+                self.static = False
+        if tokens[0] == "for" and self.JOIN_LOOPS and not self.used_after_loop(stmt):
+            self.loop = stmt
+        elif tokens[0] == "args":
             if len(tokens) > 1:
                 self.args = tokens[1]
             else:
@@ -58,6 +188,42 @@ class Compiler:
         elif tokens[0] == "set":
             self.indent()
             self.file_out.write(stmt[3:].strip() + "\n")
+        elif tokens[0] == "await":
+            self.indent()
+            self.file_out.write(stmt + "\n")
+        elif tokens[0] == "async":
+            # a bare "async" only marks the template as async
+            if len(tokens) > 1:
+                self.indent()
+                self.file_out.write(stmt + ":\n")
+                self.stack.append(tokens[1].split(None, 1)[0])
+        elif tokens[0] == "cache":
+            # {% cache key ttl %}: the fragment is rendered once and then
+            # replayed from the fragment cache until it expires
+            key, ttl = tokens[1].rsplit(None, 1)
+            self.caches.append(ttl)
+            n = len(self.caches)
+            if n == 1:
+                self.indent()
+                self.file_out.write("from utemplate import fragments\n")
+            self.indent()
+            self.file_out.write("_k%d = (%s)\n" % (n, key))
+            self.indent()
+            self.file_out.write("_f%d = fragments.get(_k%d)\n" % (n, n))
+            self.indent()
+            self.file_out.write("if _f%d is None:\n" % n)
+            self.stack.append("cache")
+            self.indent()
+            self.file_out.write("_b%d = []\n" % n)
+        elif tokens[0] == "endcache":
+            assert self.stack[-1] == "cache"
+            n = len(self.caches)
+            self.indent()
+            self.file_out.write("_f%d = %s(_b%d)\n" % (n, self.joiner(), n))
+            self.indent()
+            self.file_out.write("fragments.set(_k%d, _f%d, %s)\n" % (n, n, self.caches.pop()))
+            self.stack.pop(-1)
+            self.emit("_f%d" % n)
         elif tokens[0] == "include":
             if not self.flushed_header:
                 # If there was no other output, we still need a header now
@@ -71,16 +237,33 @@ class Compiler:
                 # "1" as fromlist param is uPy hack
                 self.file_out.write('_ = __import__(%s.replace(".", "_"), None, None, 1)\n' % tokens[0][2:-2])
                 self.indent()
-                self.file_out.write("yield from _.render(%s)\n" % args)
+                if self.is_async:
+                    self.file_out.write("await AsyncRender.include(%s, _.render(%s))\n" % (self.emitter(), args))
+                elif self.caches:
+                    self.file_out.write("_b%d.extend(_.render(%s))\n" % (len(self.caches), args))
+                else:
+                    self.file_out.write("yield from _.render(%s)\n" % args)
                 return
 
             with self.loader.input_open(tokens[0][1:-1]) as inc:
                 self.seq += 1
-                c = Compiler(inc, self.file_out, len(self.stack) + self._indent, self.seq)
+                c = Compiler(inc, self.file_out, len(self.stack) + self._indent, self.seq, self.loader, self.is_async)
                 inc_id = self.seq
                 self.seq = c.compile()
+            if self.static and c.static:
+                self.text += c.text
+            else:
+                self.static = False
+            for name in [tokens[0][1:-1]] + c.includes:
+                if name not in self.includes:
+                    self.includes.append(name)
             self.indent()
-            self.file_out.write("yield from render%d(%s)\n" % (inc_id, args))
+            if self.is_async:
+                self.file_out.write("await render%d(%s)\n" % (inc_id, self.emitter() + ", " + args if args else self.emitter()))
+            elif self.caches:
+                self.file_out.write("_b%d.extend(render%d(%s))\n" % (len(self.caches), inc_id, args))
+            else:
+                self.file_out.write("yield from render%d(%s)\n" % (inc_id, args))
         elif len(tokens) > 1:
             if tokens[0] == "elif":
                 assert self.stack[-1] == "if"
@@ -108,17 +291,18 @@ class Compiler:
                 self.literal(l)
                 return
             self.literal(l[:start])
-            self.close_literal()
             sel = l[start + 1]
             #print("*%s=%s=" % (sel, EXPR))
             if sel == self.STMNT:
                 end = l.find(self.STMNT_END)
                 assert end > 0
                 stmt = l[start + len(self.START_CHAR + self.STMNT):end].strip()
+                # the text after the statement, for used_after_loop()
+                self.tail = l[end + len(self.STMNT_END):]
                 self.parse_statement(stmt)
                 end += len(self.STMNT_END)
                 l = l[end:]
-                if not self.in_literal and l == "\n":
+                if l == "\n":
                     break
             elif sel == self.EXPR:
     #            print("EXPR")
@@ -132,14 +316,236 @@ class Compiler:
                 self.literal(l[start])
                 l = l[start + 1:]
 
+    @staticmethod
+    def names(code):
+        # Returns the identifiers in a piece of code
+        names = []
+        name = ""
+        for c in code + " ":
+            if c.isalpha() or c.isdigit() or c == "_":
+                name += c
+            elif name:
+                names.append(name)
+                name = ""
+        return names
+
+    def used_after_loop(self, stmt):
+        # Whether a variable of a "for" statement is read after its loop,
+        # before another loop assigns it
+        targets = self.names(stmt[4:].split(" in ", 1)[0])
+        rest = self.tail + self.source[self.line_end:]
+        in_loop = True
+        pos = 0
+        while True:
+            start = rest.find(self.START_CHAR, pos)
+            if start == -1:
+                return False
+            sel = rest[start + 1:start + 2]
+            if sel != self.STMNT and sel != self.EXPR:
+                pos = start + 1
+                continue
+            end = rest.find(self.STMNT_END if sel == self.STMNT else self.EXPR_END, start)
+            assert end > 0
+            code = rest[start + 2:end].strip()
+            pos = end + 2
+            if in_loop:
+                in_loop = sel != self.STMNT or code != "endfor"
+                continue
+            assigned = []
+            if sel == self.STMNT and code.startswith("for "):
+                target, _, code = code[4:].partition(" in ")
+                assigned = self.names(target)
+            names = self.names(code)
+            for t in targets:
+                if t in names:
+                    return True
+            targets = [t for t in targets if t not in assigned]
+            if not targets:
+                return False
+
     def header(self):
         self.file_out.write("# Autogenerated file\n")
 
+    def tags(self, text):
+        # Returns (start, end, statement) tuples for the statements in the
+        # text, with end after the newline that the parser would skip
+        tags = []
+        start = text.find(self.START_CHAR + self.STMNT)
+        while start != -1:
+            end = text.find(self.STMNT_END, start)
+            assert end > 0
+            stmt = text[start + len(self.START_CHAR + self.STMNT):end].strip()
+            end += len(self.STMNT_END)
+            if text[end:end + 1] == "\n":
+                end += 1
+            tags.append((start, end, stmt))
+            start = text.find(self.START_CHAR + self.STMNT, end)
+        return tags
+
+    def split_blocks(self, text):
+        # Splits the text in literal text, (name, body) tuples for the
+        # outermost blocks and None for "super" statements outside blocks
+        items = []
+        pos = 0
+        depth = 0
+        for start, end, stmt in self.tags(text):
+            tokens = stmt.split()
+            if tokens[0] == "block":
+                if not depth:
+                    items.append(text[pos:start])
+                    name = tokens[1]
+                    body = end
+                depth += 1
+            elif tokens[0] == "endblock":
+                depth -= 1
+                if not depth:
+                    items.append((name, text[body:start]))
+                    pos = end
+            elif tokens[0] == "super" and not depth:
+                items.append(text[pos:start])
+                items.append(None)
+                pos = end
+        assert not depth
+        items.append(text[pos:])
+        return items
+
+    def block_map(self, text, blocks):
+        # Adds the blocks defined in the text, at any depth, to a dict
+        for item in self.split_blocks(text):
+            if isinstance(item, tuple):
+                blocks[item[0]] = item[1]
+                self.block_map(item[1], blocks)
+        return blocks
+
+    def expand(self, text, chain, supers):
+        # Replaces each block with its most derived definition, and "super"
+        # with the definition that it overrides
+        out = []
+        for item in self.split_blocks(text):
+            if item is None:
+                if supers:
+                    out.append(self.expand(supers[0], chain, supers[1:]))
+            elif isinstance(item, tuple):
+                levels = [m[item[0]] for m in chain if item[0] in m] + [item[1]]
+                out.append(self.expand(levels[0], chain, levels[1:]))
+            else:
+                out.append(item)
+        return "".join(out)
+
+    def inherit(self, text):
+        # Resolves "extends" and "block" statements at compile time, so that
+        # the whole hierarchy is rendered by a single flat function
+        chain = []
+        args = None
+        while True:
+            parent = None
+            # "args" can be before or after "extends"
+            for start, end, stmt in self.tags(text):
+                tokens = stmt.split(None, 1)
+                if tokens[0] == "args":
+                    if args is None:
+                        args = text[start:end]
+                elif tokens[0] == "extends" and parent is None:
+                    parent = tokens[1][1:-1]
+            if parent is None:
+                break
+            chain.append(self.block_map(text, {}))
+            with self.loader.input_open(parent) as f:
+                text = f.read()
+            if parent not in self.includes:
+                self.includes.append(parent)
+        text = self.expand(text, chain, [])
+        if chain and args is not None:
+            # the arguments of the most derived template are used
+            out = [args]
+            pos = 0
+            for start, end, stmt in self.tags(text):
+                if stmt.split(None, 1)[0] == "args":
+                    out.append(text[pos:start])
+                    pos = end
+            out.append(text[pos:])
+            text = "".join(out)
+        lines = text.split("\n")
+        return [l + "\n" for l in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+
+    def detect_async(self, lines, seen=()):
+        # A template is async if a statement starts with "await" or "async",
+        # or an expression starts with "await", or if a template that it
+        # includes or extends by name is async, as the included templates
+        # are compiled into the same module
+        for l in lines:
+            start = l.find(self.START_CHAR)
+            while start != -1:
+                sel = l[start + 1:start + 2]
+                if sel == self.STMNT or sel == self.EXPR:
+                    tokens = l[start + 2:].split(None, 1)
+                    if tokens and (tokens[0] == "await" or sel == self.STMNT and tokens[0] == "async"):
+                        return True
+                    if sel == self.STMNT and tokens and tokens[0] in ("include", "extends"):
+                        end = l.find(self.STMNT_END, start)
+                        name = l[start + 2:end].split()[1]
+                        if name[0] in "\"'" and name[1:-1] not in seen:
+                            with self.loader.input_open(name[1:-1]) as f:
+                                if self.detect_async(f, seen + (name[1:-1],)):
+                                    return True
+                start = l.find(self.START_CHAR, start + 1)
+        return False
+
     def compile(self):
+        top = not self.seq
+        lines = list(self.file_in)
+        text = "".join(lines)
+        for start, end, stmt in self.tags(text):
+            if stmt.split(None, 1)[0] in ("extends", "block"):
+                lines = self.inherit(text)
+                break
+        if self.is_async is None:
+            self.is_async = self.detect_async(lines)
+        if self.is_async:
+            self.static = False
+        if top:
+            # the code is not needed if the output turns out to be static
+            file_out = self.file_out
+            self.file_out = io.StringIO()
         self.header()
-        for l in self.file_in:
+        if self.is_async and top:
+            self.file_out.write("from utemplate import AsyncRender\n")
+        elif self.BYTES and top:
+            self.file_out.write("from utemplate import ByteRender\n")
+        self.source = "".join(lines)
+        self.line_end = 0
+        for l in lines:
+            self.line_end += len(l)
             self.parse_line(l)
-        self.close_literal()
+        if self.loop is not None:
+            self.open_loop()
+        self.flush()
+        if not self.flushed_header:
+            # a template without output still needs its render function
+            self.indent()
+            self.file_out.write("pass\n" if self.is_async else "yield from ()\n")
+        if self.is_async and top:
+            # the render function returns an async iterator, so that sync
+            # and async templates are used in the same way
+            self.file_out.write("def render(*a, **d):\n    return AsyncRender(render_async, a, d%s)\n" % (', b""' if self.BYTES else ""))
+        elif self.BYTES and top:
+            # lets Microdot write the chunks without encoding them
+            self.file_out.write("def render(*a, **d):\n    return ByteRender(render_bytes(*a, **d))\n")
+        if top:
+            code = self.file_out.getvalue()
+            self.file_out = file_out
+            if self.static:
+                # the output is rendered once, when the module is imported
+                text = "".join(self.text)
+                self.header()
+                self.file_out.write("from utemplate import StaticRender\n")
+                self.file_out.write("_static = StaticRender(%s)\n" % (repr(text.encode()) if self.BYTES else self.quote(text)))
+                self.file_out.write("def render(*a, **d):\n    return _static\n")
+            else:
+                self.file_out.write(code)
+        if self.includes and top:
+            # lets the loader recompile the template when an include changes
+            self.file_out.write("INCLUDES = (%s)\n" % "".join('"%s", ' % i for i in self.includes))
         return self.seq
 
 
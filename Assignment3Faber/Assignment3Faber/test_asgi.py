@@ -0,0 +1,114 @@
+"""
+Tests of the ``microdot_asgi`` adapter.
+
+The adapter is driven in process with hand-built ASGI ``scope``, ``receive``
+and ``send`` callables, so no ASGI server or network is needed.
+
+Usage::
+
+    python -m unittest test_asgi
+"""
+import asyncio
+import json
+import unittest
+
+from microdot import Microdot, Response
+from microdot_asgi import ASGIApp
+
+
+def call(asgi_app, method, path, body=b'', headers=None):
+    """Send a request to an ASGI application and return the response as a
+    ``(status, headers, body chunks)`` tuple."""
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': b'',
+        'http_version': '1.1',
+        'headers': [(name.lower().encode(), value.encode())
+                    for name, value in (headers or {}).items()],
+        'client': ('127.0.0.1', 1234),
+    }
+    if body:
+        scope['headers'].append((b'content-length', str(len(body)).encode()))
+    packets = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    messages = []
+
+    async def receive():
+        if packets:
+            return packets.pop(0)
+        # the client stays connected until the response is complete
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    assert messages[0]['type'] == 'http.response.start'
+    for message in messages[1:]:
+        assert message['type'] == 'http.response.body'
+    assert messages[-1]['more_body'] is False
+    return (messages[0]['status'],
+            {name.decode(): value.decode()
+             for name, value in messages[0]['headers']},
+            [message['body'] for message in messages[1:]])
+
+
+class TestASGI(unittest.TestCase):
+    def setUp(self):
+        app = Microdot()
+
+        @app.post('/echo')
+        async def echo(req):
+            return {'received': req.json}
+
+        @app.get('/lines')
+        def lines(req):
+            def generate():
+                for i in range(3):
+                    yield 'line {}\n'.format(i)
+            return generate()
+
+        @app.get('/history')
+        async def history(req):
+            return Response.stream_json(
+                {'sensor': 'light', 'samples': (i * 10 for i in range(100))},
+                buffer_size=64)
+
+        self.asgi_app = ASGIApp(app)
+
+    def test_json_post(self):
+        status, headers, chunks = call(
+            self.asgi_app, 'POST', '/echo', body=b'{"light": 42}',
+            headers={'Content-Type': 'application/json'})
+        self.assertEqual(status, 200)
+        self.assertTrue(headers['content-type'].startswith(
+            'application/json'))
+        self.assertEqual(json.loads(b''.join(chunks)),
+                         {'received': {'light': 42}})
+
+    def test_sync_generator(self):
+        status, headers, chunks = call(self.asgi_app, 'GET', '/lines')
+        self.assertEqual(status, 200)
+        self.assertEqual(b''.join(chunks), b'line 0\nline 1\nline 2\n')
+
+    def test_stream_json(self):
+        status, headers, chunks = call(self.asgi_app, 'GET', '/history')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'],
+                         'application/json; charset=UTF-8')
+        self.assertNotIn('content-length', headers)
+        # the body is sent in more than one chunk
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(json.loads(b''.join(chunks)),
+                         {'sensor': 'light',
+                          'samples': [i * 10 for i in range(100)]})
+
+    def test_not_found(self):
+        status, headers, chunks = call(self.asgi_app, 'GET', '/missing')
+        self.assertEqual(status, 404)
+        self.assertEqual(b''.join(chunks), b'Not found')
+
+
+if __name__ == '__main__':
+    unittest.main()
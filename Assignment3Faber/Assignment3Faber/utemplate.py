@@ -1,7 +1,320 @@
+try:
+    import asyncio
+except ImportError:  # pragma: no cover
+    import uasyncio as asyncio
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: no cover
+    from ucollections import OrderedDict
+
+try:
+    from time import ticks_ms, ticks_add, ticks_diff
+except ImportError:
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
 from recompile import Loader
 
 
 _loader = None
+# render functions by template name, in least to most recently used order,
+# stored as (render, ticks of the last check) tuples
+_cache = OrderedDict()
+_cache_size = 16
+_revalidate = 1000
+
+
+def _load(name):
+    entry = _cache.get(name)
+    if entry is not None:
+        del _cache[name]
+        if _revalidate is None or \
+                ticks_diff(ticks_ms(), entry[1]) < _revalidate:
+            _cache[name] = entry
+            return entry[0]
+    render = _loader.load(name)
+    if _cache_size:
+        while len(_cache) >= _cache_size:
+            del _cache[next(iter(_cache))]
+        _cache[name] = (render, ticks_ms())
+    return render
+
+
+class FragmentCache:
+    """A cache of rendered template fragments.
+
+    :param size: the maximum number of fragments in the cache. The least
+                 recently used fragment is evicted when the cache is full.
+
+    Fragments are stored by the ``{% cache key ttl %}...{% endcache %}``
+    statement of the templates. The key is any hashable expression, and the
+    fragment expires after ``ttl`` seconds, or never if ``ttl`` is 0 or
+    ``None``. Keys are shared by all the templates, so they should be
+    specific enough to not collide. The cache used by the templates is the
+    ``fragments`` instance of this module.
+    """
+    def __init__(self, size=32):
+        self.size = size
+        # fragments by key, in least to most recently used order, stored as
+        # (fragment, expiration ticks) tuples
+        self.entries = OrderedDict()
+        #: The number of fragments that were found in the cache.
+        self.hits = 0
+        #: The number of fragments that had to be rendered.
+        self.misses = 0
+
+    def get(self, key):
+        """Return the fragment stored with the given key, or ``None`` if it
+        is not in the cache or it expired."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            del self.entries[key]
+            if entry[1] is None or ticks_diff(entry[1], ticks_ms()) > 0:
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[0]
+        self.misses += 1
+        return None
+
+    def set(self, key, fragment, ttl):
+        """Store a fragment in the cache.
+
+        :param key: the key of the fragment.
+        :param fragment: the rendered fragment.
+        :param ttl: the number of seconds the fragment is valid for, or 0 or
+                    ``None`` for no expiration.
+        """
+        if not self.size:
+            return
+        if key in self.entries:
+            del self.entries[key]
+        while len(self.entries) >= self.size:
+            del self.entries[next(iter(self.entries))]
+        self.entries[key] = (
+            fragment, ticks_add(ticks_ms(), int(ttl * 1000)) if ttl else None)
+
+    def invalidate(self, key=None):
+        """Remove fragments from the cache, so that they are rendered again.
+
+        :param key: the key of the fragment to remove. If omitted, all the
+                    fragments are removed.
+        """
+        if key is None:
+            self.entries.clear()
+        elif key in self.entries:
+            del self.entries[key]
+
+
+#: The cache of the ``{% cache %}`` template fragments.
+fragments = FragmentCache()
+
+
+class StaticRender:
+    """The output of a template that does not depend on its arguments.
+
+    :param text: the output of the template, as a string, or as ``bytes`` for
+                 templates compiled with bytes output.
+
+    The compiler detects templates without expressions or control
+    statements, including their static includes, and renders them when the
+    compiled module is loaded. Their render function returns the same
+    instance of this class on every call, so that the output can be
+    prepared once for sending, as the ``microdot_prerender`` module does.
+    """
+    def __init__(self, text):
+        self.text = text
+
+    def __iter__(self):
+        return iter((self.text,))
+
+
+class ByteRender:
+    """An iterator over the chunks of a template compiled with bytes output.
+
+    :param chunks: the generator of the template, which yields ``bytes``.
+
+    The render function of templates compiled with the ``BYTES`` option of
+    ``source.Compiler`` returns an instance of this class. The literals of
+    these templates are encoded when the template is compiled, so only the
+    expressions are encoded when it is rendered. When iterated
+    asynchronously, as Microdot does with response bodies, consecutive
+    chunks are joined up to ``buffer_size`` bytes and written without
+    further encoding or worker threads. As with the synchronous bodies of
+    Microdot responses, control is returned to the event loop every
+    ``yield_chunks`` chunks or ``yield_ms`` milliseconds, so that a large
+    render does not block other connections.
+    """
+    #: The number of bytes that are joined into each asynchronous chunk.
+    buffer_size = 1024
+
+    #: The number of chunks after which control is returned to the event
+    #: loop.
+    yield_chunks = 32
+
+    #: The maximum time in milliseconds that the template runs before control
+    #: is returned to the event loop.
+    yield_ms = 10
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.count = 0
+        self.start = None
+
+    def __iter__(self):
+        return self.chunks
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.start is None:
+            self.start = ticks_ms()
+        buffer = []
+        size = 0
+        for chunk in self.chunks:
+            buffer.append(chunk)
+            size += len(chunk)
+            self.count += 1
+            if self.count >= self.yield_chunks or \
+                    ticks_diff(ticks_ms(), self.start) >= self.yield_ms:
+                # let other tasks run during long renders
+                await asyncio.sleep(0)
+                self.count = 0
+                self.start = ticks_ms()
+            if size >= self.buffer_size:
+                break
+        if not buffer:
+            raise StopAsyncIteration
+        return b''.join(buffer)
+
+    async def aclose(self):
+        """Stop the template."""
+        self.chunks.close()
+
+
+class AsyncRender:
+    """An asynchronous iterator over the chunks of an async template.
+
+    :param render: the ``async def`` render function of the template, which
+                   receives a coroutine that is awaited with each chunk.
+    :param args: the positional arguments for the template.
+    :param kwargs: the keyword arguments for the template.
+    :param empty: the output of an empty template, ``b""`` for templates
+                  compiled with bytes output.
+
+    Templates that use ``await`` expressions or ``async for`` loops are
+    compiled to ``async def`` functions, and their ``render`` function
+    returns an instance of this class. The template runs in a task of its own
+    and its chunks are buffered in a list, so that chunks that are produced
+    while the consumer is busy are joined and returned together. The
+    template is paused when ``max_chunks`` chunks are waiting.
+    """
+    #: The number of buffered chunks that pause the template.
+    max_chunks = 8
+
+    def __init__(self, render, args, kwargs, empty=''):
+        self.render_async = render
+        self.args = args
+        self.kwargs = kwargs
+        self.empty = empty
+        self.buffer = []
+        self.task = None
+        self.done = False
+        self.exc = None
+
+    def __iter__(self):
+        # sync templates can only include async templates statically, as
+        # dynamic includes are resolved when the template is rendered
+        raise TypeError('an async template cannot be iterated or included '
+                        'dynamically by a sync template, mark the including '
+                        'template with {% async %}')
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.task is None:
+            self.ready = asyncio.Event()
+            self.taken = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+        while not self.buffer:
+            if self.done:
+                if self.exc is not None:
+                    exc = self.exc
+                    self.exc = None
+                    raise exc
+                raise StopAsyncIteration
+            self.ready.clear()
+            await self.ready.wait()
+        # chunks are bytes for templates compiled with bytes output
+        chunk = self.buffer[0][:0].join(self.buffer)
+        self.buffer = []
+        self.taken.set()
+        return chunk
+
+    async def aclose(self):
+        """Stop the template, if it is still running."""
+        if self.task is not None and not self.done:
+            self.task.cancel()
+            try:
+                await self.task
+            except BaseException:
+                pass
+        self.done = True
+
+    async def render(self):
+        """Run the template and return its output as a string, or as bytes
+        for templates compiled with bytes output."""
+        buffer = []
+
+        async def emit(chunk):
+            buffer.append(chunk)
+
+        await self.render_async(emit, *self.args, **self.kwargs)
+        return self.empty.join(buffer)
+
+    @staticmethod
+    def collector(buffer):
+        # Return an emit coroutine that appends the chunks to a list
+        async def emit(chunk):
+            buffer.append(chunk)
+
+        return emit
+
+    @staticmethod
+    async def include(emit, chunks):
+        # Render a dynamically included template, which may be sync or async
+        if isinstance(chunks, AsyncRender):
+            await chunks.render_async(emit, *chunks.args, **chunks.kwargs)
+        else:
+            for chunk in chunks:
+                await emit(chunk)
+
+    async def _emit(self, chunk):
+        self.buffer.append(chunk)
+        self.ready.set()
+        if len(self.buffer) >= self.max_chunks:
+            self.taken.clear()
+            await self.taken.wait()
+
+    async def _run(self):
+        try:
+            await self.render_async(self._emit, *self.args, **self.kwargs)
+        except Exception as exc:
+            self.exc = exc
+        self.done = True
+        self.ready.set()
 
 
 class Template:
@@ -12,7 +325,9 @@ class Template:
     """
     @classmethod
     def initialize(cls, template_dir='templates',
-                   loader_class=Loader):
+                   loader_class=Loader, cache_size=16, revalidate=1,
+                   production=False, fragment_cache_size=32,
+                   **loader_options):
         """Initialize the templating subsystem.
 
         :param template_dir: the directory where templates are stored. This
@@ -23,30 +338,99 @@ class Template:
                              is the ``recompile.Loader`` class, which
                              automatically recompiles templates when they
                              change.
+        :param cache_size: the number of render functions that are kept in
+                           memory, so that the loader does not run for every
+                           render. The least recently used templates are
+                           evicted when the cache is full. Set to 0 to load
+                           templates on every use.
+        :param revalidate: the number of seconds after which a cached
+                           template is loaded again, giving the loader a
+                           chance to recompile it if its source changed. Set
+                           to 0 to check the template on every use.
+        :param production: if ``True``, cached templates are never
+                           revalidated, so no file system calls are made once
+                           a template is loaded.
+        :param fragment_cache_size: the number of fragments that are kept in
+                                    the cache of the ``{% cache %}``
+                                    statement. Set to 0 to disable it.
+        :param loader_options: additional options for the loader class, such
+                               as the ``cache_dir`` of the
+                               ``inmemory.Loader`` class.
         """
-        global _loader
-        _loader = loader_class(None, template_dir)
+        global _loader, _cache_size, _revalidate
+        _loader = loader_class(None, template_dir, **loader_options)
+        _cache_size = cache_size
+        _revalidate = None if production else int(revalidate * 1000)
+        _cache.clear()
+        fragments.size = fragment_cache_size
+        fragments.invalidate()
+
+    @classmethod
+    def clear_cache(cls, template=None):
+        """Remove templates from the cache of render functions.
+
+        :param template: the filename of the template to remove. If omitted,
+                         all the templates are removed.
+        """
+        if template is None:
+            _cache.clear()
+        elif template in _cache:
+            del _cache[template]
 
     def __init__(self, template):
         if _loader is None:  # pragma: no cover
             self.initialize()
         #: The name of the template
         self.name = template
-        self.template = _loader.load(template)
+        self.template = _load(template)
 
     def generate(self, *args, **kwargs):
         """Return a generator that renders the template in chunks, with the
-        given arguments."""
-        return self.template(*args, **kwargs)
+        given arguments.
+
+        For async templates, an :class:`AsyncRender` asynchronous iterator is
+        returned instead.
+        """
+        chunks = self.template(*args, **kwargs)
+        if isinstance(chunks, StaticRender):
+            return iter(chunks)
+        return chunks
+
+    def prerendered(self, *args, **kwargs):
+        """Return the :class:`StaticRender` output of the template if it does
+        not depend on its arguments, or ``None`` otherwise."""
+        chunks = self.template(*args, **kwargs)
+        if isinstance(chunks, StaticRender):
+            return chunks
+        if hasattr(chunks, 'close'):
+            # the render has not started, so it is safe to discard it
+            chunks.close()
+        return None
 
     def render(self, *args, **kwargs):
         """Render the template with the given arguments and return it as a
-        string."""
-        return ''.join(self.generate(*args, **kwargs))
+        string, or as ``bytes`` if the template was compiled with bytes
+        output.
+
+        Async templates can only be rendered with :meth:`render_async`.
+        """
+        chunks = self.template(*args, **kwargs)
+        if isinstance(chunks, StaticRender):
+            return chunks.text
+        if isinstance(chunks, AsyncRender):
+            raise TypeError('async template {} must be rendered with '
+                            'render_async()'.format(self.name))
+        if isinstance(chunks, ByteRender):
+            return b''.join(chunks)
+        return ''.join(chunks)
 
     def generate_async(self, *args, **kwargs):
         """Return an asynchronous generator that renders the template in
         chunks, using the given arguments."""
+        chunks = self.generate(*args, **kwargs)
+        if isinstance(chunks, (AsyncRender, ByteRender)):
+            return chunks
+
         class sync_to_async_iter():
             def __init__(self, iter):
                 self.iter = iter
@@ -60,13 +444,18 @@ class Template:
                 except StopIteration:
                     raise StopAsyncIteration
 
-        return sync_to_async_iter(self.generate(*args, **kwargs))
+        return sync_to_async_iter(chunks)
 
     async def render_async(self, *args, **kwargs):
         """Render the template with the given arguments asynchronously and
-        return it as a string."""
-        response = ''
-        async for chunk in self.generate_async(*args, **kwargs):
-            response += chunk
-        return response
+        return it as a string, or as ``bytes`` if the template was compiled
+        with bytes output."""
+        chunks = self.template(*args, **kwargs)
+        if isinstance(chunks, StaticRender):
+            return chunks.text
+        if isinstance(chunks, AsyncRender):
+            return await chunks.render()
+        if isinstance(chunks, ByteRender):
+            return b''.join(chunks)
+        return ''.join(chunks)
 
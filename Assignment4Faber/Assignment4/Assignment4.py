@@ -6,7 +6,7 @@ import ujson
 import time
 import machine
 import urequests
-from microdot import Microdot, Response  # Lightweight web framework for microcontrollers
+from microdot import Microdot, Response, RequestScheduler  # Lightweight web framework for microcontrollers
 
 # Constant for configuration file path
 CONFIG_FILE = 'config.json'
@@ -124,6 +124,8 @@ class ConfigServer:
     def __init__(self, config_manager):
         self.config_manager = config_manager
         self.app = Microdot()  # Web server instance
+        # Keep one request slot free for the save form while assets load
+        self.app.scheduler = RequestScheduler(max_concurrency=3, reserved=1)
         Response.default_content_type = 'text/html'  # Default response type
         self.create_routes()  # Define web routes
         self.ap = network.WLAN(network.AP_IF)  # Access Point interface
@@ -149,25 +151,30 @@ class ConfigServer:
 
         # Handle form submission to save config
         @self.app.route('/save', methods=['POST'])
+        @self.app.priority(RequestScheduler.HIGH)
         def save_config(req):
             # Extract submitted values
             ssid = req.form.get('ssid', '')
             password = req.form.get('password', '')
             api_key = req.form.get('api_key', '')
 
-            # Update configuration and save it
+            # Update configuration
             self.config_manager.config['ssid'] = ssid
             self.config_manager.config['password'] = password
             self.config_manager.config['api_key'] = api_key
-            self.config_manager.save()
 
-            # Restart device after saving
+            # Save and restart once the response has been sent
             print("Saving and restarting.")
-            self.ap.active(False)
-            time.sleep(1)
-            machine.reset()
+            req.defer(self.save_and_restart)
             return "Saving and restarting."
 
+    def save_and_restart(self):
+        # Save the configuration to flash and restart the device
+        self.config_manager.save()
+        self.ap.active(False)
+        time.sleep(1)
+        machine.reset()
+
     def start(self):
         # Start the access point for configuration
         ssid = "Config-Device"
@@ -176,5 +183,9 @@ class ConfigServer:
         self.ap.config(essid=ssid, password=password)
         ip = self.ap.ifconfig()[0]
         print(f"Launched AP: {ssid} | IP: {ip}")
-        self.app.run(host='0.0.0.0', port=80)  # Start web server
+        self.serve()
+
+    def serve(self):
+        # Start web server, together with any periodic tasks of the app
+        self.app.run(host='0.0.0.0', port=80)
 
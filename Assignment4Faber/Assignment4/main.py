@@ -40,7 +40,7 @@ def main():
         rgb.red_on()         # Turn on red LED to indicate IoT mode is active
         client = IoTClient(config.config['api_key'])
 
-        while True:
+        def check_button():
             # If button is pressed during IoT operation, switch to config mode
             if button.value() == 0:
                 print("Entering configuration mode")
@@ -49,8 +49,11 @@ def main():
                 time.sleep(1)
                 machine.reset()  # Restart the device to re-enter config mode
 
-            client.send_data()   # Send data to the IoT platform
-            time.sleep(1)        # Wait before sending next data packet
+        # Send data and watch the button while serving the configuration page
+        server = ConfigServer(config)
+        server.app.every(0.1, check_button)
+        server.app.every(1, client.send_data)  # Send data to the IoT platform
+        server.serve()
     else:
         # If WiFi connection fails, enter configuration mode
         print("WiFi failed - entering configuration mode..")
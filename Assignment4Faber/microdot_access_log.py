@@ -0,0 +1,175 @@
+"""
+microdot_access_log
+-------------------
+
+The ``microdot_access_log`` module implements an access log that records
+requests in memory and writes them in batches from a background task.
+"""
+import sys
+import time
+from random import getrandbits
+
+from microdot import invoke_handler
+
+try:
+    import orjson as json
+except ImportError:
+    import json
+
+
+class AccessLog:
+    """An access log with a ring buffer and batched writes.
+
+    :param app: The application instance. If omitted, :meth:`initialize` must
+                be called later.
+    :param stream: The file-like object the log is written to, or the path of
+                   a file that is opened in append mode. The default is
+                   ``sys.stdout``.
+    :param capacity: The number of entries that the ring buffer holds between
+                     flushes. When the buffer is full, the oldest entries are
+                     overwritten and counted in :attr:`dropped`.
+    :param flush_interval: The number of seconds between writes of the log.
+    :param sample_rate: The fraction of requests that are logged, between 0
+                        and 1. The default is to log all requests.
+    :param json_lines: If ``True``, each entry is written as a JSON object in
+                       its own line. The default is a space separated text
+                       line.
+
+    Recording a request only stores a tuple in the ring buffer, so the cost
+    on the request path is a few microseconds. The entries are formatted and
+    written by a periodic task of the application. On CPython the write runs
+    in a worker thread, so a slow file or console does not block the event
+    loop.
+
+    Each entry has the time, the client address, the method and path of the
+    request, the URL pattern of the route that handled it, the status code,
+    the number of body bytes sent and the time taken to handle the request in
+    milliseconds.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot_access_log import AccessLog
+
+        app = Microdot()
+        AccessLog(app, stream='access.log', sample_rate=0.5)
+    """
+    def __init__(self, app=None, stream=None, capacity=64, flush_interval=1,
+                 sample_rate=1, json_lines=False):
+        self.stream = stream
+        self.file = None
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.sample_threshold = int(sample_rate * 65536)
+        self.json_lines = json_lines
+        self.entries = [None] * capacity
+        self.next = 0
+        self.count = 0
+        self.lost = 0
+        self.flush_task = None
+        #: The number of requests that were recorded.
+        self.logged = 0
+        #: The number of entries that were overwritten before they could be
+        #: written.
+        self.dropped = 0
+        if app is not None:
+            self.initialize(app)
+
+    def initialize(self, app):
+        """Install the access log in an application.
+
+        :param app: The application instance.
+        """
+        app.access_log = self
+        self.flush_task = app.every(self.flush_interval, self.flush)
+
+    def log(self, req, res, sent, duration):
+        """Record a request in the ring buffer.
+
+        :param req: The request object.
+        :param res: The response object.
+        :param sent: The number of body bytes sent to the client.
+        :param duration: The time taken to handle the request, in
+                         microseconds.
+
+        Microdot calls this method after each response is written.
+        """
+        if self.sample_threshold < 65536 and \
+                getrandbits(16) >= self.sample_threshold:
+            return
+        if self.count == self.capacity:
+            self.dropped += 1
+            self.lost += 1
+        else:
+            self.count += 1
+        self.entries[self.next] = (
+            time.time(), (req.client_addr and req.client_addr[0]) or '-',
+            req.method, req.path, req.route, res.status_code, sent,
+            duration)
+        self.next = (self.next + 1) % self.capacity
+        self.logged += 1
+
+    async def flush(self):
+        """Write the entries in the ring buffer to the log.
+
+        This method is a coroutine. It is invoked periodically by the
+        application.
+        """
+        if not self.count and not self.lost:
+            return
+        start = (self.next - self.count) % self.capacity
+        entries = [self.entries[(start + i) % self.capacity]
+                   for i in range(self.count)]
+        lost = self.lost
+        self.count = 0
+        self.lost = 0
+        lines = [self.format(entry) for entry in entries]
+        if lost:
+            lines.insert(0, '{} access log entries dropped\n'.format(lost))
+        await invoke_handler(self._write, ''.join(lines))
+
+    async def close(self):
+        """Stop the periodic task, write the remaining entries and close the
+        log file, if one was opened.
+
+        This method is a coroutine.
+        """
+        if self.flush_task is not None:
+            self.flush_task.stop()
+        await self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def format(self, entry):
+        """Format a log entry as a line of text.
+
+        :param entry: The entry, a tuple with the time, client address,
+                      method, path, route, status code, bytes sent and
+                      duration in microseconds.
+
+        Subclasses can override this method to change the log format.
+        """
+        t = time.gmtime(int(entry[0]))
+        timestamp = '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z'.format(*t[:6])
+        if self.json_lines:
+            line = json.dumps({
+                'time': timestamp, 'client': entry[1], 'method': entry[2],
+                'path': entry[3], 'route': entry[4], 'status': entry[5],
+                'bytes': entry[6], 'duration_ms': entry[7] / 1000})
+            return (line.decode() if isinstance(line, bytes) else line) + '\n'
+        return '{} {} "{} {}" {} {} {:.3f}ms {}\n'.format(
+            timestamp, entry[1], entry[2], entry[3], entry[5], entry[6],
+            entry[7] / 1000, entry[4] or '-')
+
+    def _write(self, text):
+        stream = self.stream
+        if stream is None:
+            stream = sys.stdout
+        elif isinstance(stream, str):
+            if self.file is None:
+                self.file = open(stream, 'a')
+            stream = self.file
+        stream.write(text)
+        if hasattr(stream, 'flush'):
+            stream.flush()
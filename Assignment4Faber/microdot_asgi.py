@@ -0,0 +1,211 @@
+"""
+microdot_asgi
+-------------
+
+The ``microdot_asgi`` module provides an adapter that runs Microdot
+applications on ASGI web servers under CPython.
+"""
+import asyncio
+
+from microdot import NoCaseDict, Request, ticks_us, ticks_diff
+
+
+class _BodyStream:  # pragma: no cover
+    def __init__(self, receive):
+        self.receive = receive
+        self.data = b''
+        self.more = True
+
+    async def read_more(self):
+        if self.more:
+            packet = await self.receive()
+            self.data += packet.get('body', b'')
+            self.more = packet.get('more_body', False)
+
+    async def read(self, n=-1):
+        while self.more and (n < 0 or len(self.data) < n):
+            await self.read_more()
+        if n < 0 or len(self.data) < n:
+            data = self.data
+            self.data = b''
+            return data
+        data = self.data[:n]
+        self.data = self.data[n:]
+        return data
+
+    async def readline(self):
+        return await self.readuntil()
+
+    async def readexactly(self, n):
+        return await self.read(n)
+
+    async def readuntil(self, separator=b'\n'):
+        while self.more and separator not in self.data:
+            await self.read_more()
+        if separator not in self.data:
+            data = self.data
+            self.data = b''
+            return data
+        data, self.data = self.data.split(separator, 1)
+        return data + separator
+
+
+class ASGIApp:
+    """An ASGI application that serves a Microdot application.
+
+    :param app: The :class:`Microdot <microdot.Microdot>` instance to serve.
+
+    The routes, middleware and error handlers of the application are used
+    unchanged. Periodic tasks registered with
+    :meth:`Microdot.every <microdot.Microdot.every>` run while the ASGI
+    server's lifespan is active, and functions scheduled with
+    :meth:`Request.defer <microdot.Request.defer>` run after the response has
+    been sent. When the lifespan ends, the background tasks are given
+    :attr:`Microdot.drain_timeout <microdot.Microdot.drain_timeout>` seconds to
+    complete and the access log is flushed. In-flight requests are drained by
+    the ASGI server.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot_asgi import ASGIApp
+
+        app = Microdot()
+
+        @app.route('/')
+        async def index(request):
+            return 'Hello, world!'
+
+        asgi_app = ASGIApp(app)
+
+    The ``asgi_app`` object can then be given to an ASGI web server such as
+    Uvicorn::
+
+        uvicorn --workers 4 main:asgi_app
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':  # pragma: no branch
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            event = await receive()
+            if event['type'] == 'lifespan.startup':
+                for task in self.app.periodic_tasks:
+                    task.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif event['type'] == 'lifespan.shutdown':  # pragma: no branch
+                await self.app.drain()
+                await send({'type': 'lifespan.shutdown.complete'})
+                break
+
+    async def http(self, scope, receive, send):
+        start = ticks_us()
+        path = scope['path']
+        if scope.get('query_string'):
+            path += '?' + scope['query_string'].decode()
+        headers = NoCaseDict()
+        content_length = 0
+        for name, value in scope.get('headers', []):
+            name = name.decode()
+            value = value.decode()
+            if name in headers:
+                headers[name] += ', ' + value
+            else:
+                headers[name] = value
+            if name.lower() == 'content-length':
+                content_length = int(value)
+
+        if content_length and content_length <= Request.max_body_length:
+            body = b''
+            more = True
+            while more:
+                packet = await receive()
+                body += packet.get('body', b'')
+                more = packet.get('more_body', False)
+            stream = None
+        else:
+            body = b''
+            stream = _BodyStream(receive)
+
+        client = scope.get('client') or ('', 0)
+        req = Request(self.app, (client[0], client[1]), scope['method'], path,
+                      scope.get('http_version', '1.1'), headers, body=body,
+                      stream=stream, sock=(receive, send))
+        req.g.asgi_scope = scope
+        if self.app.keep_raw_headers:
+            req.raw_headers = ['{}: {}'.format(name.decode(), value.decode())
+                               for name, value in scope.get('headers', [])]
+
+        try:
+            res = await self.app.dispatch_request(req)
+            sent = await self.send_response(res, receive, send)
+        finally:
+            if self.app.scheduler is not None:
+                self.app.scheduler.release(req)
+        if self.app.access_log is not None:
+            self.app.access_log.log(req, res, sent,
+                                    ticks_diff(ticks_us(), start))
+
+        for f, args, kwargs in req.deferred:
+            await self.app.background_tasks.put(f, *args, **kwargs)
+
+    async def send_response(self, res, receive, send):
+        res.complete()
+
+        header_list = []
+        for name, value in res.headers.items():
+            values = value if isinstance(value, list) else [value]
+            for value in values:
+                header_list.append((name.lower().encode(), value.encode()))
+        await send({'type': 'http.response.start',
+                    'status': res.status_code,
+                    'headers': header_list})
+
+        disconnected = False
+
+        async def disconnect_monitor():
+            nonlocal disconnected
+            while True:
+                event = await receive()
+                if event is None or event['type'] == 'http.disconnect':
+                    disconnected = True
+                    break
+
+        monitor = asyncio.ensure_future(disconnect_monitor())
+        try:
+            # each chunk is sent when the next one is available, so that the
+            # last chunk can be marked as the end of the body
+            body = b''
+            sent = 0
+            if not res.is_head:
+                iter = res.body_iter().__aiter__()
+                try:
+                    body = await iter.__anext__()
+                    while not disconnected:
+                        next_body = await iter.__anext__()
+                        if isinstance(body, str):
+                            body = body.encode()
+                        await send({'type': 'http.response.body',
+                                    'body': body, 'more_body': True})
+                        sent += len(body)
+                        body = next_body
+                except StopAsyncIteration:
+                    pass
+                finally:
+                    if hasattr(iter, 'aclose'):  # pragma: no branch
+                        await iter.aclose()
+            if not disconnected:
+                if isinstance(body, str):
+                    body = body.encode()
+                await send({'type': 'http.response.body',
+                            'body': body, 'more_body': False})
+                sent += len(body)
+        finally:
+            monitor.cancel()
+        return sent
@@ -0,0 +1,202 @@
+"""
+microdot_cache
+--------------
+
+The ``microdot_cache`` module implements an opt-in cache of fully serialized
+``GET`` responses for Microdot routes.
+"""
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: no cover
+    from ucollections import OrderedDict
+
+from microdot import AsyncBytesIO, Response, MUTED_SOCKET_ERRORS, \
+    invoke_handler, ticks_ms, ticks_add, ticks_diff
+
+
+class CachedResponse(Response):
+    """A response that replays the serialized bytes of a cached response.
+
+    :param status_code: The status code of the cached response.
+    :param headers: The headers of the cached response. This dictionary is
+                    shared by all the hits of the entry and should be treated
+                    as read-only.
+    :param head: The status line and headers, as bytes.
+    :param body: The body, as bytes.
+
+    Writing this response sends the stored bytes as they are, so neither
+    :meth:`Response.complete` nor the header formatting run again. Changes
+    made to the response by after request handlers are not sent to the
+    client.
+    """
+    def __init__(self, status_code, headers, head, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.reason = None
+        self.head = head
+        self.body = body
+        self.is_head = False
+
+    def complete(self):
+        pass
+
+    async def write(self, stream):
+        try:
+            await stream.awrite(self.head)
+            if not self.is_head and self.body:
+                await stream.awrite(self.body)
+                return len(self.body)
+        except OSError as exc:  # pragma: no cover
+            if exc.errno in MUTED_SOCKET_ERRORS or \
+                    exc.args[0] == 'Connection lost':
+                pass
+            else:
+                raise
+        return 0
+
+
+class ResponseCache:
+    """A cache of serialized responses with TTL and LRU eviction.
+
+    :param max_bytes: The total number of header and body bytes that the
+                      cache is allowed to hold. When a new entry does not fit,
+                      the least recently used entries are evicted to make
+                      room for it.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot_cache import ResponseCache
+
+        app = Microdot()
+        cache = ResponseCache(max_bytes=16 * 1024)
+
+        @app.get('/')
+        @cache.cached(ttl=10)
+        def index(request):
+            return Template('index.html').generate()
+    """
+    def __init__(self, max_bytes=8 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        #: The number of requests that were answered from the cache.
+        self.hits = 0
+        #: The number of requests that invoked the route handler.
+        self.misses = 0
+
+    def cached(self, ttl=60, args=None, vary=None):
+        """Decorator that enables response caching for a route.
+
+        :param ttl: The number of seconds a cached response remains valid.
+        :param args: A list of query string arguments that are part of the
+                     cache key. Any other query string arguments are ignored.
+        :param vary: A list of request headers that are part of the cache key.
+                     These headers are also returned to the client in the
+                     ``Vary`` header.
+
+        Only ``GET`` and ``HEAD`` requests are cached, and only responses with
+        a 200 status code and a body that is not a file are stored. Responses
+        that set cookies, or that have a ``Cache-Control`` header with the
+        ``private`` or ``no-store`` directives, are never stored, as they
+        are meant for a single client. The decorator must be placed below
+        the route decorator.
+        """
+        args = args or []
+        vary = vary or []
+
+        def decorated(f):
+            async def cached_handler(req, *a, **kw):
+                if req.method not in ['GET', 'HEAD']:
+                    return await invoke_handler(f, req, *a, **kw)
+                key = self._make_key(req, args, vary)
+                entry = self._lookup(key)
+                if entry is not None:
+                    self.hits += 1
+                    return CachedResponse(*entry[1:])
+                self.misses += 1
+
+                @req.after_request
+                async def store(req, res):
+                    return await self._store(key, ttl, vary, res)
+
+                return await invoke_handler(f, req, *a, **kw)
+            return cached_handler
+        return decorated
+
+    def invalidate(self, path=None):
+        """Remove cached responses.
+
+        :param path: The request path for which cached responses should be
+                     removed. If omitted, the cache is emptied.
+        """
+        for key in list(self.entries.keys()):
+            if path is None or key[0] == path:
+                self._remove(key)
+
+    @staticmethod
+    def _make_key(req, args, vary):
+        key = [req.path, req.method]
+        for arg in args:
+            key.append(tuple(req.args.getlist(arg)) if arg in req.args
+                       else None)
+        for header in vary:
+            key.append(req.headers.get(header))
+        return tuple(key)
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if ticks_diff(entry[0], ticks_ms()) <= 0:
+            self._remove(key)
+            return None
+        # move the entry to the most recently used position
+        del self.entries[key]
+        self.entries[key] = entry
+        return entry
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= len(entry[3]) + len(entry[4])
+
+    async def _store(self, key, ttl, vary, res):
+        if isinstance(res, CachedResponse) or res.status_code != 200 or \
+                hasattr(res.body, 'read') or 'Set-Cookie' in res.headers:
+            return res
+        cache_control = res.headers.get('Cache-Control', '')
+        if 'private' in cache_control or 'no-store' in cache_control:
+            return res
+        if vary:
+            res.headers['Vary'] = ', '.join(vary)
+
+        # render the complete body, including streamed bodies
+        if not isinstance(res.body, bytes):
+            chunks = []
+            body = res.body_iter()
+            try:
+                async for chunk in body:
+                    chunks.append(chunk.encode() if isinstance(chunk, str)
+                                  else chunk)
+            finally:
+                if hasattr(body, 'aclose'):
+                    await body.aclose()
+            res.body = b''.join(chunks)
+
+        # serialize the status line and the headers
+        head = AsyncBytesIO(b'')
+        res.is_head = True
+        await res.write(head)
+        head = head.stream.getvalue()
+
+        entry = (ticks_add(ticks_ms(), int(ttl * 1000)), res.status_code,
+                 res.headers, head, res.body)
+        size = len(head) + len(res.body)
+        if size <= self.max_bytes:
+            if key in self.entries:
+                self._remove(key)
+            while self.size + size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+            self.entries[key] = entry
+            self.size += size
+        return CachedResponse(*entry[1:])
@@ -0,0 +1,99 @@
+"""
+microdot_coalesce
+-----------------
+
+The ``microdot_coalesce`` module implements single-flight request coalescing
+for expensive Microdot routes.
+"""
+import asyncio
+
+from microdot import Response, invoke_handler
+
+
+async def _read_body(body):
+    if body is None or isinstance(body, (str, bytes, dict, list)):
+        return body
+    # streamed bodies can only be consumed once, so they are read in full
+    chunks = []
+    iter = Response(body).body_iter()
+    async for chunk in iter:
+        chunks.append(chunk.encode() if isinstance(chunk, str) else chunk)
+    if hasattr(iter, 'aclose'):
+        await iter.aclose()
+    return b''.join(chunks)
+
+
+async def _make_shareable(res):
+    if isinstance(res, Response):
+        res.body = await _read_body(res.body)
+    elif isinstance(res, tuple):
+        res = (await _read_body(res[0]),) + res[1:]
+    elif not isinstance(res, int):
+        res = await _read_body(res)
+    return res
+
+
+def _copy(res):
+    if isinstance(res, Response):
+        return Response(res.body, res.status_code, res.headers, res.reason)
+    return res
+
+
+def coalesce(f):
+    """Decorator that coalesces concurrent identical requests to a route.
+
+    While a request is being handled, any other requests with the same method,
+    URL and body that arrive for the route wait for the handler invocation
+    that is in progress and receive a copy of its result, instead of invoking
+    the handler again. Nothing is stored once the invocation completes, so the
+    next request invokes the handler again. If the handler raises an
+    exception, it is raised for all the waiting requests. If the request that
+    invoked the handler is cancelled, one of the waiting requests invokes it
+    again.
+
+    Streamed response bodies are read in full before they are shared, so this
+    decorator is intended for routes that return small responses. The
+    decorator must be placed below the route decorator.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot_coalesce import coalesce
+
+        app = Microdot()
+
+        @app.get('/value')
+        @coalesce
+        def value(request):
+            return str(sensor.read())
+    """
+    in_flight = {}
+
+    async def coalesced_handler(req, *args, **kwargs):
+        key = (req.method, req.url, req.body)
+        while True:
+            call = in_flight.get(key)
+            if call is None:
+                # this request is the leader, so it invokes the handler
+                call = in_flight[key] = [asyncio.Event(), None, None, False]
+                try:
+                    call[1] = await _make_shareable(
+                        await invoke_handler(f, req, *args, **kwargs))
+                    call[3] = True
+                except Exception as exc:
+                    call[2] = exc
+                    call[3] = True
+                finally:
+                    del in_flight[key]
+                    call[0].set()
+            else:
+                await call[0].wait()
+                if not call[3]:
+                    # the leader was cancelled before the handler completed,
+                    # so the waiting requests invoke it again
+                    continue
+            if call[2] is not None:
+                raise call[2]
+            return _copy(call[1])
+
+    return coalesced_handler
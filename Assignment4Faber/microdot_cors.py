@@ -0,0 +1,209 @@
+"""
+microdot_cors
+-------------
+
+The ``microdot_cors`` module adds Cross-Origin Resource Sharing (CORS) support
+to Microdot applications.
+"""
+
+
+class CORS:
+    """Add CORS headers to the responses of an application.
+
+    :param app: The application instance. If omitted, :meth:`initialize` must
+                be called later.
+    :param allowed_origins: A list of origins that are allowed to make
+                            cross-origin requests, or ``'*'`` to allow all
+                            origins. The default is ``'*'``.
+    :param allow_credentials: If ``True``, browsers are allowed to send
+                              cookies with cross-origin requests. The default
+                              is ``False``.
+    :param allowed_methods: A list of methods that are allowed in preflight
+                            requests. If omitted, the methods of the routes
+                            that match the requested URL are used.
+    :param allowed_headers: A list of request headers that are allowed in
+                            preflight requests. If omitted, the headers
+                            requested by the browser are allowed.
+    :param expose_headers: A list of response headers that browsers expose to
+                           the cross-origin client.
+    :param max_age: The number of seconds browsers can cache the result of a
+                    preflight request. Set to ``None`` to let browsers use
+                    their own default, which is just a few seconds. The
+                    default is 600. Note that Chromium based browsers cap this
+                    value at 7200 seconds.
+    :param max_paths: The number of dynamic URLs, such as ``/users/42``, for
+                      which the preflight headers are remembered. The headers
+                      of static URLs are always remembered.
+
+    The ``Allow`` and ``Access-Control-*`` headers of each route are computed
+    once, when the first ``OPTIONS`` request is received or when routes are
+    added afterwards, so preflight requests are answered with a dictionary
+    lookup instead of matching the URL against every route.
+
+    When ``allowed_origins`` is a list and a route is cached with
+    :class:`ResponseCache <microdot_cache.ResponseCache>`, ``Origin`` must be
+    included in the ``vary`` argument of the cache, as cached responses are
+    sent without invoking the after request handlers.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot_cors import CORS
+
+        app = Microdot()
+        CORS(app, allowed_origins=['https://dashboard.example.com'],
+             max_age=3600)
+    """
+    def __init__(self, app=None, allowed_origins='*', allow_credentials=False,
+                 allowed_methods=None, allowed_headers=None,
+                 expose_headers=None, max_age=600, max_paths=32):
+        self.allowed_origins = allowed_origins
+        self.allow_credentials = allow_credentials
+        self.allowed_methods = allowed_methods
+        self.allowed_headers = allowed_headers
+        self.expose_headers = expose_headers
+        self.max_age = max_age
+        self.max_paths = max_paths
+        self.app = None
+        self.static_paths = {}
+        self.dynamic_paths = {}
+        self.dynamic_routes = []
+        self.frozen_routes = -1
+
+        # headers added to the responses of all the allowed origins
+        self.response_headers = {}
+        if allow_credentials:
+            self.response_headers['Access-Control-Allow-Credentials'] = \
+                'true'
+        if expose_headers:
+            self.response_headers['Access-Control-Expose-Headers'] = \
+                ', '.join(expose_headers)
+        if allowed_origins == '*' and not allow_credentials:
+            self.response_headers['Access-Control-Allow-Origin'] = '*'
+
+        if app is not None:
+            self.initialize(app)
+
+    def initialize(self, app):
+        """Install the CORS handlers in an application.
+
+        :param app: The application instance.
+        """
+        self.app = app
+        app.options_handler = self.options_handler
+        app.after_request(self.after_request)
+        app.after_error_request(self.after_request)
+
+    def freeze(self):
+        """Compute the headers of the preflight responses of all the routes.
+
+        This method is invoked automatically when the number of routes in the
+        application changes, so it only needs to be called directly when
+        routes are modified in place.
+        """
+        static_paths = []
+        self.dynamic_routes = []
+        for methods, pattern, _, _, _, _ in self.app.url_map:
+            if '<' in pattern.url_pattern:
+                self.dynamic_routes.append((methods, pattern))
+            else:
+                static_paths.append('/' + pattern.url_pattern.lstrip('/'))
+        routes = [(methods, pattern)
+                  for methods, pattern, _, _, _, _ in self.app.url_map]
+        self.static_paths = {}
+        for path in static_paths:
+            self.static_paths[path] = self._route_headers(path, routes)
+        self.dynamic_paths = {}
+        self.frozen_routes = len(self.app.url_map)
+
+    def get_cors_headers(self, req):
+        """Return the CORS headers for a request.
+
+        :param req: The request object.
+
+        ``None`` is returned when the request does not come from an allowed
+        origin.
+        """
+        origin = req.headers.get('Origin')
+        if origin is None:
+            return None
+        if self.allowed_origins == '*':
+            if not self.allow_credentials:
+                return self.response_headers
+        elif origin not in self.allowed_origins:
+            return None
+        # the origin is echoed, so the response depends on it
+        headers = {'Access-Control-Allow-Origin': origin, 'Vary': 'Origin'}
+        headers.update(self.response_headers)
+        return headers
+
+    def options_handler(self, req):
+        """Handle an ``OPTIONS`` request, including CORS preflight requests.
+
+        :param req: The request object.
+
+        This method replaces the ``options_handler`` of the application.
+        """
+        if self.frozen_routes != len(self.app.url_map):
+            self.freeze()
+        path_headers = self.static_paths.get(req.path) or \
+            self.dynamic_paths.get(req.path)
+        if path_headers is None:
+            path_headers = self._route_headers(req.path, self.dynamic_routes)
+            if len(self.dynamic_paths) >= self.max_paths:
+                del self.dynamic_paths[next(iter(self.dynamic_paths))]
+            self.dynamic_paths[req.path] = path_headers
+        allow, preflight = path_headers
+
+        cors_headers = self.get_cors_headers(req)
+        if cors_headers is None or \
+                'Access-Control-Request-Method' not in req.headers:
+            headers = dict(allow)
+        else:
+            headers = dict(preflight)
+            if 'Access-Control-Allow-Headers' not in headers and \
+                    'Access-Control-Request-Headers' in req.headers:
+                headers['Access-Control-Allow-Headers'] = \
+                    req.headers['Access-Control-Request-Headers']
+        if cors_headers is not None:
+            headers.update(cors_headers)
+        return headers
+
+    async def after_request(self, req, res):
+        """Add the CORS headers to a response.
+
+        :param req: The request object.
+        :param res: The response object.
+        """
+        headers = self.get_cors_headers(req)
+        if headers is not None:
+            vary = res.headers.get('Vary')
+            res.headers.update(headers)
+            if vary and 'Vary' in headers:
+                res.headers['Vary'] = vary if 'origin' in vary.lower() \
+                    else vary + ', Origin'
+        return res
+
+    def _route_headers(self, path, routes):
+        methods = []
+        for route_methods, pattern in routes:
+            if pattern.match(path) is not None:
+                for method in route_methods:
+                    if method not in methods:
+                        methods.append(method)
+        if 'GET' in methods and 'HEAD' not in methods:
+            methods.append('HEAD')
+        if 'OPTIONS' not in methods:
+            methods.append('OPTIONS')
+        allow = {'Allow': ', '.join(methods)}
+        preflight = {
+            'Allow': allow['Allow'],
+            'Access-Control-Allow-Methods':
+                ', '.join(self.allowed_methods or methods),
+        }
+        if self.allowed_headers:
+            preflight['Access-Control-Allow-Headers'] = \
+                ', '.join(self.allowed_headers)
+        if self.max_age is not None:
+            preflight['Access-Control-Max-Age'] = str(self.max_age)
+        return allow, preflight
@@ -0,0 +1,173 @@
+"""
+microdot_prerender
+------------------
+
+The ``microdot_prerender`` module serves response bodies that never change,
+such as the output of templates without expressions, from memory. The
+headers, the ``ETag`` and the compressed body are prepared once, so each
+request only writes the stored bytes.
+"""
+try:
+    from hashlib import sha256
+    from binascii import hexlify
+except ImportError:  # pragma: no cover
+    sha256 = None
+
+try:
+    from gzip import compress as _compress
+
+    def gzip_compress(data):
+        # a fixed timestamp makes the output reproducible
+        return _compress(data, mtime=0)
+except ImportError:  # pragma: no cover
+    try:
+        import io
+        import deflate
+
+        def gzip_compress(data):
+            stream = io.BytesIO()
+            with deflate.DeflateIO(stream, deflate.GZIP) as f:
+                f.write(data)
+            return stream.getvalue()
+    except ImportError:
+        gzip_compress = None
+
+from microdot import AsyncBytesIO, Response
+from microdot_cache import CachedResponse
+
+
+def make_etag(body):
+    """Return a strong ``ETag`` header value for a body.
+
+    :param body: The body, as bytes.
+    """
+    if sha256 is None:  # pragma: no cover
+        return '"{:x}-{:x}"'.format(len(body), hash(body) & 0xffffffff)
+    return '"{}"'.format(hexlify(sha256(body).digest()[:8]).decode())
+
+
+class Prerendered:
+    """A response body that is prepared once and served from memory.
+
+    :param body: The body of the response, as a string or bytes.
+    :param content_type: The ``Content-Type`` header of the response.
+    :param max_age: The ``max-age`` value of the ``Cache-Control`` header, in
+                    seconds. If omitted, no ``Cache-Control`` header is sent.
+    :param compress: If ``True``, a gzip compressed copy of the body is also
+                     prepared, and sent to clients that accept it. The copy is
+                     discarded if it is not smaller than the body, or if the
+                     platform has no gzip compressor.
+
+    The responses carry a ``Content-Length`` and an ``ETag`` header. Requests
+    with a matching ``If-None-Match`` header receive a 304 response without a
+    body.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot_prerender import Prerendered
+
+        app = Microdot()
+        about = Prerendered(open('about.html').read())
+
+        @app.get('/about')
+        async def about_page(request):
+            return await about.response(request)
+    """
+    def __init__(self, body, content_type='text/html; charset=UTF-8',
+                 max_age=None, compress=True):
+        if isinstance(body, str):
+            body = body.encode()
+        self.body = body
+        self.etag = make_etag(body)
+        self.headers = {'Content-Type': content_type}
+        if max_age is not None:
+            self.headers['Cache-Control'] = 'max-age={}'.format(max_age)
+        self.gzip_body = None
+        if compress and gzip_compress is not None:
+            gzip_body = gzip_compress(body)
+            if len(gzip_body) < len(body):
+                self.gzip_body = gzip_body
+                self.headers['Vary'] = 'Accept-Encoding'
+        # serialized responses, by variant
+        self.variants = {}
+
+    async def response(self, req):
+        """Return the response for a request.
+
+        :param req: The request object.
+
+        This method is a coroutine.
+        """
+        gzip = self.gzip_body is not None and \
+            'gzip' in req.headers.get('Accept-Encoding', '')
+        etag = self.etag[:-1] + '-gzip"' if gzip else self.etag
+        variant = 'gzip' if gzip else 'identity'
+        if etag in req.headers.get('If-None-Match', ''):
+            variant += '-304'
+        entry = self.variants.get(variant)
+        if entry is None:
+            headers = dict(self.headers, ETag=etag)
+            if gzip:
+                headers['Content-Encoding'] = 'gzip'
+            if variant.endswith('-304'):
+                res = Response(None, 304, headers, reason='Not Modified')
+            else:
+                res = Response(self.gzip_body if gzip else self.body, 200,
+                               headers)
+            entry = await self._serialize(res)
+            self.variants[variant] = entry
+        return CachedResponse(*entry)
+
+    @staticmethod
+    async def _serialize(res):
+        head = AsyncBytesIO(b'')
+        res.is_head = True
+        await res.write(head)
+        return (res.status_code, res.headers, head.stream.getvalue(),
+                res.body or b'')
+
+
+# prerendered templates, by name, stored as (static render, Prerendered)
+# tuples
+_templates = {}
+
+
+async def render_template(req, name, *args,
+                          content_type='text/html; charset=UTF-8',
+                          max_age=None, compress=True):
+    """Return a response with a rendered template.
+
+    :param req: The request object.
+    :param name: The filename of the template.
+    :param args: The arguments for the template.
+    :param content_type: The ``Content-Type`` header of the response.
+    :param max_age: The ``max-age`` value of the ``Cache-Control`` header for
+                    prerendered templates.
+    :param compress: If ``True``, prerendered templates are also sent gzip
+                     compressed to clients that accept it.
+
+    Templates whose output does not depend on their arguments are rendered
+    once and served as :class:`Prerendered` bodies. If the template is
+    recompiled, it is prerendered again. Other templates are streamed.
+
+    This function is a coroutine.
+
+    Example::
+
+        @app.get('/')
+        async def index(request):
+            return await render_template(request, 'index.html')
+    """
+    from utemplate import Template
+
+    template = Template(name)
+    static = template.prerendered(*args)
+    if static is None:
+        return template.generate(*args), {'Content-Type': content_type}
+    entry = _templates.get(name)
+    if entry is None or entry[0] is not static:
+        entry = (static, Prerendered(static.text, content_type, max_age,
+                                     compress))
+        _templates[name] = entry
+    return await entry[1].response(req)
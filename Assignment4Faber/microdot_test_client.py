@@ -0,0 +1,249 @@
+"""
+microdot_test_client
+--------------------
+
+The ``microdot_test_client`` module implements a client that sends requests
+to a Microdot application in the same process, without using sockets.
+"""
+from microdot import AsyncBytesIO, json
+
+
+class _InMemoryWriter:
+    def __init__(self, client_addr):
+        self.client_addr = client_addr
+        self.chunks = []
+
+    async def awrite(self, data):
+        self.chunks.append(data)
+
+    async def aclose(self):
+        pass
+
+    def get_extra_info(self, name):
+        if name == 'peername':
+            return self.client_addr
+
+
+class TestResponse:
+    """A response object issued by the Microdot test client."""
+    def __init__(self):
+        #: The numeric status code returned by the server.
+        self.status_code = None
+        #: The text reason associated with the status response, such as
+        #: ``'OK'`` or ``'NOT FOUND'``.
+        self.reason = None
+        #: A dictionary with the response headers. Headers that appear more
+        #: than once, such as ``Set-Cookie``, are stored as a list.
+        self.headers = {}
+        #: The body of the response, as a bytes object.
+        self.body = None
+        #: The body of the response, decoded to a UTF-8 string. Set to
+        #: ``None`` if the response cannot be represented as UTF-8 text.
+        self.text = None
+        #: The body of the JSON response, decoded to a dictionary or list.
+        #: Set to ``None`` if the response does not have a JSON payload.
+        self.json = None
+
+    @classmethod
+    def create(cls, data):
+        """Parse the raw bytes written by the application into a response.
+
+        :param data: The bytes of the status line, headers and body.
+        """
+        res = cls()
+        head, _, res.body = data.partition(b'\r\n\r\n')
+        lines = head.decode().split('\r\n')
+        status = lines[0].split(' ', 2)
+        res.status_code = int(status[1])
+        res.reason = status[2] if len(status) > 2 else ''
+        for line in lines[1:]:
+            name, value = line.split(':', 1)
+            value = value.strip()
+            if name in res.headers:
+                if not isinstance(res.headers[name], list):
+                    res.headers[name] = [res.headers[name]]
+                res.headers[name].append(value)
+            else:
+                res.headers[name] = value
+        try:
+            res.text = res.body.decode()
+        except ValueError:
+            pass
+        content_type = res.headers.get('Content-Type', '')
+        if res.text is not None and \
+                content_type.split(';')[0] == 'application/json':
+            res.json = json.loads(res.text)
+        return res
+
+
+class TestClient:
+    """A test client for Microdot.
+
+    :param app: The Microdot application instance.
+    :param cookies: A dictionary of cookies to use when sending requests to
+                    the application.
+    :param client_addr: The client address reported to the application, as
+                        a tuple (host, port).
+
+    Requests are serialized to bytes and handed to
+    :meth:`Microdot.handle_request <microdot.Microdot.handle_request>` with
+    in-memory streams, so the complete request parsing and response writing
+    paths of the application are exercised.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot_test_client import TestClient
+
+        app = Microdot()
+
+        @app.get('/')
+        def index(request):
+            return 'Hello, World!'
+
+        async def test_hello_world():
+            client = TestClient(app)
+            res = await client.get('/')
+            assert res.status_code == 200
+            assert res.text == 'Hello, World!'
+    """
+    __test__ = False  # remove this class from pytest's test collection
+
+    def __init__(self, app, cookies=None, client_addr=('127.0.0.1', 1234)):
+        self.app = app
+        self.cookies = cookies or {}
+        self.client_addr = client_addr
+
+    def _serialize(self, method, path, headers, body):
+        if body is None:
+            body = b''
+        elif isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            if 'Content-Type' not in headers:  # pragma: no branch
+                headers['Content-Type'] = 'application/json'
+        if isinstance(body, str):
+            body = body.encode()
+        if body and 'Content-Length' not in headers:
+            headers['Content-Length'] = str(len(body))
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                '{}={}'.format(name, value)
+                for name, value in self.cookies.items())
+        lines = ['{} {} HTTP/1.0'.format(method, path)]
+        for name, value in headers.items():
+            lines.append('{}: {}'.format(name, value))
+        lines.append('\r\n')
+        return '\r\n'.join(lines).encode() + body
+
+    def _update_cookies(self, res):
+        cookies = res.headers.get('Set-Cookie', [])
+        if not isinstance(cookies, list):
+            cookies = [cookies]
+        for cookie in cookies:
+            cookie_name, cookie_value = cookie.split(';', 1)[0].split('=', 1)
+            if '; Max-Age=0' in cookie:
+                self.cookies.pop(cookie_name, None)
+            else:
+                self.cookies[cookie_name] = cookie_value
+
+    async def request(self, method, path, headers=None, body=None):
+        """Send a request to the application.
+
+        :param method: The request method.
+        :param path: The request path, with an optional query string.
+        :param headers: A dictionary of request headers.
+        :param body: The request body. If a dictionary or list is given, it
+                     is sent as JSON. A string is encoded to UTF-8.
+
+        This method is a coroutine. It returns a :class:`TestResponse`
+        object.
+        """
+        reader = AsyncBytesIO(self._serialize(method, path,
+                                              dict(headers or {}), body))
+        writer = _InMemoryWriter(self.client_addr)
+        await self.app.handle_request(reader, writer)
+        res = TestResponse.create(b''.join(writer.chunks))
+        self._update_cookies(res)
+        return res
+
+    async def send(self, data):
+        """Send the raw bytes of a request to the application.
+
+        :param data: The request line, headers and body of the request, as
+                     bytes.
+
+        The cookies of the client are not added to the request. This method
+        is a coroutine. It returns a :class:`TestResponse` object.
+        """
+        writer = _InMemoryWriter(self.client_addr)
+        await self.app.handle_request(AsyncBytesIO(data), writer)
+        return TestResponse.create(b''.join(writer.chunks))
+
+    async def get(self, path, headers=None):
+        """Send a ``GET`` request to the application.
+
+        :param path: The request path, with an optional query string.
+        :param headers: A dictionary of request headers.
+
+        This method is a coroutine. It returns a :class:`TestResponse`
+        object.
+        """
+        return await self.request('GET', path, headers=headers)
+
+    async def head(self, path, headers=None):
+        """Send a ``HEAD`` request to the application.
+
+        :param path: The request path, with an optional query string.
+        :param headers: A dictionary of request headers.
+
+        This method is a coroutine. It returns a :class:`TestResponse`
+        object.
+        """
+        return await self.request('HEAD', path, headers=headers)
+
+    async def post(self, path, headers=None, body=None):
+        """Send a ``POST`` request to the application.
+
+        :param path: The request path, with an optional query string.
+        :param headers: A dictionary of request headers.
+        :param body: The request body.
+
+        This method is a coroutine. It returns a :class:`TestResponse`
+        object.
+        """
+        return await self.request('POST', path, headers=headers, body=body)
+
+    async def put(self, path, headers=None, body=None):
+        """Send a ``PUT`` request to the application.
+
+        :param path: The request path, with an optional query string.
+        :param headers: A dictionary of request headers.
+        :param body: The request body.
+
+        This method is a coroutine. It returns a :class:`TestResponse`
+        object.
+        """
+        return await self.request('PUT', path, headers=headers, body=body)
+
+    async def patch(self, path, headers=None, body=None):
+        """Send a ``PATCH`` request to the application.
+
+        :param path: The request path, with an optional query string.
+        :param headers: A dictionary of request headers.
+        :param body: The request body.
+
+        This method is a coroutine. It returns a :class:`TestResponse`
+        object.
+        """
+        return await self.request('PATCH', path, headers=headers, body=body)
+
+    async def delete(self, path, headers=None):
+        """Send a ``DELETE`` request to the application.
+
+        :param path: The request path, with an optional query string.
+        :param headers: A dictionary of request headers.
+
+        This method is a coroutine. It returns a :class:`TestResponse`
+        object.
+        """
+        return await self.request('DELETE', path, headers=headers)